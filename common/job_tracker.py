@@ -0,0 +1,91 @@
+import random
+import time
+
+
+class JobFailedError(Exception):
+    pass
+
+
+class JobTimeoutError(Exception):
+    pass
+
+
+# Personalize のインポートジョブなど、長時間かかるジョブをまとめて追跡し、指数バックオフ + ジッターでポーリングする
+class JobTracker:
+    def __init__(self, min_interval=5.0, max_interval=60.0, multiplier=1.5, timeout=None, metrics=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        self.timeout = timeout
+        # metrics (metrics.Metrics) を指定すると、完了したジョブごとに待ち時間を出力する
+        self.metrics = metrics
+        self.jobs = {}
+
+    def add(self, name, poll, success_statuses, failure_statuses):
+        # poll は (ステータス, 進捗を表す dict または None) を返す関数
+        self.jobs[name] = {
+            "Name": name,
+            "Poll": poll,
+            "SuccessStatuses": success_statuses,
+            "FailureStatuses": failure_statuses,
+            "Status": None,
+            "Progress": None,
+            "StartedAt": time.time(),
+            "FinishedAt": None,
+            "Elapsed": None,
+            "Polls": 0,
+        }
+
+    def _next_poll(self, interval):
+        interval = min(interval * self.multiplier, self.max_interval)
+        return time.monotonic() + random.uniform(interval / 2, interval), interval
+
+    def _is_finished(self, job):
+        return job["Status"] in job["SuccessStatuses"] or job["Status"] in job["FailureStatuses"]
+
+    def wait_all(self, raise_on_failure=True):
+        pending = {
+            name: (time.monotonic() + self.min_interval, self.min_interval)
+            for name, job in self.jobs.items()
+            if not self._is_finished(job)
+        }
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        while pending:
+            name = min(pending, key=lambda n: pending[n][0])
+            poll_at, interval = pending[name]
+            delay = poll_at - time.monotonic()
+            if deadline and time.monotonic() + max(delay, 0) > deadline:
+                raise JobTimeoutError(f"Timed out waiting for jobs: {', '.join(pending)}")
+            if delay > 0:
+                time.sleep(delay)
+
+            job = self.jobs[name]
+            job["Status"], job["Progress"] = job["Poll"]()
+            job["Polls"] += 1
+            progress = ""
+            if job["Progress"]:
+                progress = " " + ", ".join(f"{key}: {value}" for key, value in job["Progress"].items())
+
+            if self._is_finished(job):
+                del pending[name]
+                job["FinishedAt"] = time.time()
+                job["Elapsed"] = job["FinishedAt"] - job["StartedAt"]
+                print(f"Job {name} {job['Status']} in {job['Elapsed']:.0f}s (polls: {job['Polls']}){progress}")
+                if self.metrics is not None:
+                    self.metrics.emit(
+                        f"job:{name}",
+                        {"WaitTime": (job["Elapsed"] * 1000, "Milliseconds"), "Polls": (job["Polls"], "Count")},
+                        Status=job["Status"],
+                    )
+            else:
+                print(f"Job {name} is {job['Status']} ({time.time() - job['StartedAt']:.0f}s elapsed){progress}")
+                pending[name] = self._next_poll(interval)
+
+        failures = [job for job in self.jobs.values() if job["Status"] in job["FailureStatuses"]]
+        if failures and raise_on_failure:
+            messages = ", ".join(f"{job['Name']} ({job['Status']})" for job in failures)
+            raise JobFailedError(f"Jobs failed: {messages}")
+        return self.get_metrics()
+
+    def get_metrics(self):
+        return [{key: value for key, value in job.items() if key != "Poll"} for job in self.jobs.values()]
@@ -0,0 +1,105 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "PersonalizePipeline")
+# cprofile / tracemalloc を指定すると処理全体をプロファイルし、終了時に上位 PROFILE_TOP 件を出力する
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "").lower()
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "30"))
+# cprofile の場合、指定したパスに pstats 形式の結果も書き出す
+PROFILE_OUTPUT = os.environ.get("PROFILE_OUTPUT", "")
+
+
+class Span:
+    # ステージの実行中に行数・バイト数などを積算し、終了時に処理時間と一緒に出力する
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def add(self, name, value, unit="Count"):
+        with self.lock:
+            current, _ = self.values.get(name, (0, unit))
+            self.values[name] = (current + value, unit)
+
+
+# メトリクスを CloudWatch Embedded Metric Format (EMF) の JSON として標準出力に書き出す
+# Lambda ではそのまま CloudWatch のメトリクスになり、ローカルでは標準出力で確認できる
+class Metrics:
+    def __init__(self, service, namespace=METRICS_NAMESPACE):
+        self.service = service
+        self.namespace = namespace
+        self.lock = threading.Lock()
+
+    def emit(self, stage, values, **properties):
+        # values は {メトリクス名: (値, 単位)}。properties はメトリクスにしない付加情報 (ファイル名など)
+        if not values:
+            return
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [["Service", "Stage"]],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in values.items()],
+                    }
+                ],
+            },
+            "Service": self.service,
+            "Stage": stage,
+            **properties,
+            **{name: value for name, (value, _) in values.items()},
+        }
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self.lock:
+            print(line, flush=True)
+
+    @contextmanager
+    def span(self, stage, **properties):
+        span = Span()
+        start = time.perf_counter()
+        status = "Succeeded"
+        try:
+            yield span
+        except BaseException:
+            status = "Failed"
+            raise
+        finally:
+            values = {"Duration": ((time.perf_counter() - start) * 1000, "Milliseconds"), **span.values}
+            self.emit(stage, values, Status=status, **properties)
+
+    @contextmanager
+    def profile(self):
+        if PROFILE_MODE == "cprofile":
+            # メインスレッドのみが対象 (スレッドプール・プロセスプール内の処理は含まれない)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(PROFILE_TOP)
+                print(stream.getvalue())
+                if PROFILE_OUTPUT:
+                    profiler.dump_stats(PROFILE_OUTPUT)
+        elif PROFILE_MODE == "tracemalloc":
+            tracemalloc.start()
+            try:
+                yield
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(f"tracemalloc: peak {peak / 1024 / 1024:.1f} MB. Top {PROFILE_TOP} allocations still held:")
+                for stat in snapshot.statistics("lineno")[:PROFILE_TOP]:
+                    print(stat)
+                self.emit("profile", {"PeakTracedMemory": (peak, "Bytes")})
+        else:
+            yield
@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+
+
+class StatementFailedError(Exception):
+    pass
+
+
+# Redshift Data API のステートメントを複数同時に追跡し、指数バックオフ + ジッターでポーリングする
+class RedshiftStatementExecutor:
+    def __init__(self, client, database, workgroup, min_interval=0.25, max_interval=10.0, multiplier=1.5, metrics=None):
+        self.client = client
+        self.database = database
+        self.workgroup = workgroup
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        # metrics (metrics.Metrics) を指定すると、完了したステートメントごとに実行時間を出力する
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.statements = {}
+
+    def _track(self, statement_id, name):
+        with self.lock:
+            self.statements[statement_id] = {
+                "Id": statement_id,
+                "Name": name or statement_id,
+                "Status": "SUBMITTED",
+                "SubmittedAt": time.time(),
+                "FinishedAt": None,
+                "Elapsed": None,
+                "RedshiftDuration": None,
+                "Polls": 0,
+                "Error": None,
+            }
+        return statement_id
+
+    def submit(self, sql, name=None):
+        response = self.client.execute_statement(Database=self.database, WorkgroupName=self.workgroup, Sql=sql)
+        return self._track(response["Id"], name)
+
+    def submit_batch(self, sqls, name=None):
+        # 複数の SQL を1つのトランザクションとして実行する
+        response = self.client.batch_execute_statement(Database=self.database, WorkgroupName=self.workgroup, Sqls=sqls)
+        return self._track(response["Id"], name)
+
+    def _next_poll(self, interval):
+        interval = min(interval * self.multiplier, self.max_interval)
+        return time.monotonic() + random.uniform(interval / 2, interval), interval
+
+    def _update(self, statement_id, response):
+        with self.lock:
+            metrics = self.statements[statement_id]
+            metrics["Status"] = response["Status"]
+            metrics["Polls"] += 1
+            if response["Status"] in ["FINISHED", "FAILED", "ABORTED"]:
+                metrics["FinishedAt"] = time.time()
+                metrics["Elapsed"] = metrics["FinishedAt"] - metrics["SubmittedAt"]
+                if response.get("Duration", -1) >= 0:
+                    metrics["RedshiftDuration"] = response["Duration"] / 1000000000.0
+                metrics["Error"] = response.get("Error")
+            return dict(metrics)
+
+    def wait(self, statement_ids, raise_on_failure=True):
+        pending = {statement_id: (time.monotonic() + self.min_interval, self.min_interval) for statement_id in statement_ids}
+        results = {}
+        while pending:
+            statement_id = min(pending, key=lambda i: pending[i][0])
+            poll_at, interval = pending[statement_id]
+            delay = poll_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            metrics = self._update(statement_id, self.client.describe_statement(Id=statement_id))
+            if metrics["Status"] in ["FINISHED", "FAILED", "ABORTED"]:
+                del pending[statement_id]
+                results[statement_id] = metrics
+                print(
+                    f"Statement {metrics['Name']} ({statement_id}) {metrics['Status']} in {metrics['Elapsed']:.1f}s "
+                    f"(polls: {metrics['Polls']})"
+                )
+                self._emit(metrics)
+            else:
+                pending[statement_id] = self._next_poll(interval)
+
+        failures = [metrics for metrics in results.values() if metrics["Status"] != "FINISHED"]
+        if failures and raise_on_failure:
+            messages = ", ".join(f"{m['Name']} ({m['Status']}): {m['Error']}" for m in failures)
+            raise StatementFailedError(f"Query failed: {messages}")
+        return [results[statement_id] for statement_id in statement_ids]
+
+    def _emit(self, metrics):
+        if self.metrics is None:
+            return
+        values = {"Elapsed": (metrics["Elapsed"] * 1000, "Milliseconds"), "Polls": (metrics["Polls"], "Count")}
+        if metrics["RedshiftDuration"] is not None:
+            values["RedshiftDuration"] = (metrics["RedshiftDuration"] * 1000, "Milliseconds")
+        self.metrics.emit(f"redshift:{metrics['Name']}", values, StatementId=metrics["Id"], Status=metrics["Status"])
+
+    def execute(self, sql, name=None):
+        return self.wait([self.submit(sql, name)])[0]
+
+    def execute_batch(self, sqls, name=None):
+        return self.wait([self.submit_batch(sqls, name)])[0]
+
+    def fetch_records(self, statement_id):
+        # 結果セットを全ページ取得し、各行を Python の値のリストとして返す
+        records = []
+        kwargs = {"Id": statement_id}
+        while True:
+            response = self.client.get_statement_result(**kwargs)
+            for record in response["Records"]:
+                records.append([None if field.get("isNull") else next(iter(field.values())) for field in record])
+            if not response.get("NextToken"):
+                return records
+            kwargs["NextToken"] = response["NextToken"]
+
+    def get_metrics(self):
+        with self.lock:
+            return [dict(metrics) for metrics in self.statements.values()]
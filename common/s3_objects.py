@@ -0,0 +1,72 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# DeleteObjects で1回に削除できるキーの最大数
+DELETE_BATCH_SIZE = 1000
+
+
+class S3DeleteError(Exception):
+    pass
+
+
+def _delete_batch(client, bucket_name, keys):
+    # Quiet モードでは削除に失敗したキーのみが返される
+    response = client.delete_objects(
+        Bucket=bucket_name, Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
+    )
+    return len(keys), response.get("Errors", [])
+
+
+def iter_key_batches(client, bucket_name, prefix, batch_size=DELETE_BATCH_SIZE):
+    # 全キーのリストを作らず、ページを読みながら batch_size ごとに返す
+    batch = []
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            batch.append(obj["Key"])
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _delete_batches(client, bucket_name, batches, location, max_workers):
+    # キーのバッチを並列に削除し、削除に失敗したキーがあれば例外にする
+    deleted = 0
+    errors = []
+
+    def collect(futures):
+        nonlocal deleted
+        for future in futures:
+            count, batch_errors = future.result()
+            deleted += count - len(batch_errors)
+            errors.extend(batch_errors)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = set()
+        for keys in batches:
+            # 一覧の取得が削除より速い場合にキーを溜め込まないよう、実行中のバッチ数を制限する
+            if len(running) >= max_workers * 2:
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                collect(finished)
+            running.add(executor.submit(_delete_batch, client, bucket_name, keys))
+        collect(wait(running).done)
+
+    print(f"Deleted {deleted} objects from {location}")
+    if errors:
+        for error in errors[:10]:
+            print(f"Failed to delete {error['Key']}: {error.get('Code')} {error.get('Message')}")
+        raise S3DeleteError(f"Failed to delete {len(errors)} objects from {location}")
+    return deleted
+
+
+def delete_prefix(client, bucket_name, prefix, max_workers=8):
+    # prefix 配下のオブジェクトを 1000 キーずつ並列に削除する
+    batches = iter_key_batches(client, bucket_name, prefix)
+    return _delete_batches(client, bucket_name, batches, f"{bucket_name}/{prefix}", max_workers)
+
+
+def delete_keys(client, bucket_name, keys, max_workers=8):
+    # 指定したキーのオブジェクトを 1000 キーずつ並列に削除する
+    keys = sorted(keys)
+    batches = (keys[start : start + DELETE_BATCH_SIZE] for start in range(0, len(keys), DELETE_BATCH_SIZE))
+    return _delete_batches(client, bucket_name, batches, bucket_name, max_workers)
@@ -1,14 +1,32 @@
 import boto3
-import json
 import csv
+import gzip
+import json
 from io import StringIO
 from datetime import datetime, timedelta, timezone
 import time
 import os
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from functools import partial
+from botocore.config import Config
+import pyarrow as pa
+import pyarrow.parquet as pq
 from db import db_cursor, exec_sql
-
-s3 = boto3.client("s3")
-rs = boto3.client("redshift-data")
+from gaparse import (
+    LineCounter,
+    ViewEventDeduplicator,
+    extract_parquet_view_events,
+    extract_view_events,
+    get_parser,
+    to_csv_rows,
+)
+from metrics import Metrics
+from redshift_data import RedshiftStatementExecutor
+from run_manifest import RunManifest
+from s3_objects import delete_keys, delete_prefix
 
 GA_BUCKET_NAME = os.environ["GA_BUCKET_NAME"]
 TMP_BUCKET_NAME = os.environ["TMP_BUCKET_NAME"]
@@ -17,98 +35,601 @@ REDSHIFT_DATABASENAME = os.environ["REDSHIFT_DATABASENAME"]
 REDSHIFT_WORKGROUP = os.environ["REDSHIFT_WORKGROUP"]
 REGION = os.environ.get("REGION", "ap-northeast-1")
 TEST_DATE = os.environ.get("TEST_DATE", "")
+# 指定した場合は TEST_DATE からこの日付までをまとめて取り込む (バックフィル)
+TEST_END_DATE = os.environ.get("TEST_END_DATE", "")
+# GA の JSONL を1行ずつ読みながら変換し、マルチパートアップロードで書き出す
+GA_STREAMING = os.environ.get("GA_STREAMING", "false").lower() == "true"
+GA_STREAM_PART_SIZE = int(os.environ.get("GA_STREAM_PART_SIZE_MB", "8")) * 1024 * 1024
+GA_STREAM_CHUNK_SIZE = 1024 * 1024
+# GA ファイルの並列処理 (GA_WORKERS が 2 以上で有効)
+GA_WORKERS = int(os.environ.get("GA_WORKERS", "1"))
+GA_PARSE_PROCESSES = int(os.environ.get("GA_PARSE_PROCESSES", "0")) or os.cpu_count()
+GA_FILE_RETRIES = int(os.environ.get("GA_FILE_RETRIES", "3"))
+# GA の JSON パーサ (json / prefilter / orjson)
+GA_PARSER = os.environ.get("GA_PARSER", "json")
+# view_history の中間ファイル形式 (csv / parquet)
+GA_OUTPUT_FORMAT = os.environ.get("GA_OUTPUT_FORMAT", "csv")
+GA_PARQUET_ROW_GROUP_SIZE = int(os.environ.get("GA_PARQUET_ROW_GROUP_SIZE", "500000"))
+# view_history の取り込み方法 (dedup / replace)
+GA_LOAD_STRATEGY = os.environ.get("GA_LOAD_STRATEGY", "dedup")
+# アップロード前にファイル単位で重複した view_item を除去する
+GA_DEDUP = os.environ.get("GA_DEDUP", "false").lower() == "true"
+GA_DEDUP_MAX_KEYS = int(os.environ.get("GA_DEDUP_MAX_KEYS", "1000000"))
+# Aurora からの dump と Redshift への load の並列数 (2 以上でテーブルごとに並列実行)
+AURORA_WORKERS = int(os.environ.get("AURORA_WORKERS", "1"))
+# マスタ系テーブルの抽出方法 (full / incremental)
+AURORA_EXTRACT_MODE = os.environ.get("AURORA_EXTRACT_MODE", "full")
+AURORA_WATERMARK_OVERLAP = timedelta(minutes=int(os.environ.get("AURORA_WATERMARK_OVERLAP_MINUTES", "60")))
+# incremental の場合でも対象日がこの曜日(0:月曜〜6:日曜)であれば全件を抽出し、Aurora 側で削除された行を反映する (-1 で無効)
+AURORA_FULL_EXTRACT_WEEKDAY = int(os.environ.get("AURORA_FULL_EXTRACT_WEEKDAY", "6"))
+# テーブルごとに主キーまたは日時の範囲で分割して並列に export する数 (例: purchase_history=8,user_master=4)
+AURORA_EXPORT_CHUNKS = os.environ.get("AURORA_EXPORT_CHUNKS", "")
+# 分割した export を同時に実行する Aurora の接続数 (db.py のコネクションプールの上限 15 以下を指定する)
+AURORA_EXPORT_CONNECTIONS = int(os.environ.get("AURORA_EXPORT_CONNECTIONS", "4"))
+# 前回の実行が失敗している場合に、実行マニフェストを元に完了済みの処理を読み飛ばして再開する
+DATALOADER_RESUME = os.environ.get("DATALOADER_RESUME", "true").lower() == "true"
+# 実行マニフェストに GA ファイルの変換結果を保存する間隔 (ファイル数)
+RUN_MANIFEST_SAVE_FILES = int(os.environ.get("RUN_MANIFEST_SAVE_FILES", "100"))
+
+metrics = Metrics("dataloader")
+s3 = boto3.client("s3", config=Config(max_pool_connections=max(10, GA_WORKERS * 2)))
+rs = boto3.client("redshift-data")
+rs_executor = RedshiftStatementExecutor(rs, REDSHIFT_DATABASENAME, REDSHIFT_WORKGROUP, metrics=metrics)
+ga_parser = get_parser(GA_PARSER)
+export_slots = threading.BoundedSemaphore(AURORA_EXPORT_CONNECTIONS)
 
 JST = timezone(timedelta(hours=+9))
 
+VIEW_HISTORY_SCHEMA = pa.schema(
+    [
+        ("user_id", pa.string()),
+        ("item_id", pa.int64()),
+        ("view_datetime", pa.timestamp("us", tz="UTC")),
+    ]
+)
+
 
 def get_yesterday_date():
     return (datetime.now(JST) - timedelta(days=1)).date()
 
 
-def get_ga_s3_files(folder_path):
+def parse_date(date_str):
+    return datetime.strptime(date_str, "%Y%m%d").replace(tzinfo=JST).date()
+
+
+def get_target_dates():
+    if not TEST_DATE:
+        return [get_yesterday_date()]
+    start_date = parse_date(TEST_DATE)
+    end_date = parse_date(TEST_END_DATE) if TEST_END_DATE else start_date
+    if end_date < start_date:
+        raise ValueError(f"TEST_END_DATE {TEST_END_DATE} is before TEST_DATE {TEST_DATE}")
+    return [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+
+
+def list_ga_s3_objects(folder_path):
     paginator = s3.get_paginator("list_objects_v2")
     pages = paginator.paginate(Bucket=GA_BUCKET_NAME, Prefix=folder_path)
 
-    all_files = []
+    etags = {}
     for page in pages:
         if "Contents" in page:
-            all_files.extend([obj["Key"] for obj in page["Contents"]])
+            etags.update({obj["Key"]: obj["ETag"] for obj in page["Contents"]})
 
-    return all_files
+    return etags
 
 
-def process_jsonl_file(file_key):
-    response = s3.get_object(Bucket=GA_BUCKET_NAME, Key=file_key)
-    content = response["Body"].read().decode("utf-8")
+def get_ga_manifest_key(target_date):
+    return f"manifests/{target_date.strftime('%Y/%m/%d')}.json"
 
+
+def get_ga_s3_files(target_date):
+    # 対象のファイルのキーと ETag を返す。Glue ジョブが書き出したマニフェストがあればそれを使い、なければバケットを一覧する
+    try:
+        response = s3.get_object(Bucket=GA_BUCKET_NAME, Key=get_ga_manifest_key(target_date))
+    except s3.exceptions.NoSuchKey:
+        return list_ga_s3_objects(target_date.strftime("%Y/%m/%d"))
+    manifest = json.loads(response["Body"].read())
+    if any("etag" not in file for file in manifest["files"]):
+        # ETag を記録していない古いマニフェスト
+        return list_ga_s3_objects(target_date.strftime("%Y/%m/%d"))
+    # 行数は Glue ジョブで TARGET_FILE_SIZE_MB を指定した場合のみ記録される
+    rows = f", {manifest['total_rows']} rows" if "total_rows" in manifest else ""
+    print(f"GA: Read manifest ({len(manifest['files'])} files, {manifest['total_bytes']} bytes{rows})")
+    # 大きいファイルから処理し、並列処理時に最後に大きなファイルが残らないようにする
+    return {file["key"]: file["etag"] for file in sorted(manifest["files"], key=lambda file: file["bytes"], reverse=True)}
+
+
+def get_view_events(events, deduplicator):
+    if GA_DEDUP:
+        return deduplicator.filter(events)
+    return events
+
+
+class RowCounter:
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+
+
+def extract_ga_content_events(file_key, content, counter=None):
+    # Glue ジョブの出力形式 (json / json-gzip / parquet) をファイルの拡張子で判定する
+    if file_key.endswith(".parquet"):
+        return extract_parquet_view_events(pa.BufferReader(content), counter=counter)
+    if file_key.endswith(".gz"):
+        content = gzip.decompress(content)
+    return extract_view_events(content.splitlines(), ga_parser, counter)
+
+
+def transform_jsonl(file_key, content):
+    deduplicator = ViewEventDeduplicator(GA_DEDUP_MAX_KEYS)
     csv_buffer = StringIO()
     csv_writer = csv.writer(csv_buffer)
+    parsed = LineCounter()
+    rows = RowCounter(to_csv_rows(get_view_events(extract_ga_content_events(file_key, content, parsed), deduplicator)))
+    csv_writer.writerows(rows)
+
+    return csv_buffer.getvalue(), {"parsed": parsed.count, "rows": rows.count, "dropped": deduplicator.dropped}
+
+
+def process_jsonl_file(file_key, parse_executor=None):
+    response = s3.get_object(Bucket=GA_BUCKET_NAME, Key=file_key)
+    content = response["Body"].read()
+
+    if parse_executor is None:
+        csv_data, stats = transform_jsonl(file_key, content)
+    else:
+        csv_data, stats = parse_executor.submit(transform_jsonl, file_key, content).result()
+    return csv_data, {**stats, "bytes_in": len(content)}
+
+
+def iter_s3_lines(body, chunk_size=GA_STREAM_CHUNK_SIZE):
+    pending = b""
+    for chunk in body.iter_chunks(chunk_size):
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+
+def extract_ga_body_events(file_key, body, counter=None):
+    if file_key.endswith(".parquet"):
+        # Parquet はフッタから読む必要があるため、ファイル全体を読み込む
+        return extract_parquet_view_events(pa.BufferReader(body.read()), counter=counter)
+    if file_key.endswith(".gz"):
+        return extract_view_events((line.rstrip(b"\r\n") for line in gzip.GzipFile(fileobj=body)), ga_parser, counter)
+    return extract_view_events(iter_s3_lines(body), ga_parser, counter)
+
+
+class S3MultipartWriter:
+    # part_size ごとに UploadPart するため、メモリ上には最大1パート分しか保持しない
+    def __init__(self, bucket_name, file_key, part_size=GA_STREAM_PART_SIZE):
+        self.bucket_name = bucket_name
+        self.file_key = file_key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.buffer.extend(data)
+        self.position += len(data)
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = s3.create_multipart_upload(Bucket=self.bucket_name, Key=self.file_key)["UploadId"]
+        part_number = len(self.parts) + 1
+        response = s3.upload_part(
+            Bucket=self.bucket_name,
+            Key=self.file_key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer.clear()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.upload_id is None:
+            # 1パートに満たない小さなファイルは PutObject で済ませる
+            s3.put_object(Bucket=self.bucket_name, Key=self.file_key, Body=bytes(self.buffer))
+            self.buffer.clear()
+            return
+        if self.buffer:
+            self._upload_part()
+        s3.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=self.file_key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+        )
+
+    def abort(self):
+        self.closed = True
+        if self.upload_id is not None:
+            s3.abort_multipart_upload(Bucket=self.bucket_name, Key=self.file_key, UploadId=self.upload_id)
+        self.buffer.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def process_jsonl_file_streaming(file_key, target_key):
+    response = s3.get_object(Bucket=GA_BUCKET_NAME, Key=file_key)
+    deduplicator = ViewEventDeduplicator(GA_DEDUP_MAX_KEYS)
+
+    with S3MultipartWriter(TMP_BUCKET_NAME, target_key) as writer:
+        csv_writer = csv.writer(writer)
+        parsed = LineCounter()
+        rows = RowCounter(to_csv_rows(get_view_events(extract_ga_body_events(file_key, response["Body"], parsed), deduplicator)))
+        csv_writer.writerows(rows)
+
+    return {"parsed": parsed.count, "rows": rows.count, "dropped": deduplicator.dropped, "bytes_in": response["ContentLength"], "bytes_out": writer.tell()}
+
+
+def write_view_history_row_group(parquet_writer, user_ids, item_ids, event_timestamps):
+    table = pa.Table.from_arrays(
+        [
+            pa.array(user_ids, type=pa.string()),
+            pa.array(item_ids, type=pa.int64()),
+            # GA の event_timestamp は UTC のマイクロ秒なので、そのまま timestamp 型として扱える
+            # (CSV と同じ行が取り込まれるよう、秒単位への切り捨ては呼び出し側で行う)
+            pa.array(event_timestamps, type=pa.int64()).cast(pa.timestamp("us", tz="UTC")),
+        ],
+        schema=VIEW_HISTORY_SCHEMA,
+    )
+    parquet_writer.write_table(table, row_group_size=len(user_ids))
 
-    for line in content.splitlines():
-        event = json.loads(line)
-        if event["event_name"] == "view_item":
-            user_id = event.get("user_id")
-            if not user_id:
-                user_id = event.get("user_pseudo_id")
-            if not user_id:
-                break
-            items = event.get("items", [])
-            if not items:
-                break
-            item_id = items[0].get("item_id")
-            if not item_id:
-                break
-            csv_writer.writerow(
-                [user_id, item_id, datetime.fromtimestamp(event["event_timestamp"] / 1000000.0, tz=JST).strftime("%Y-%m-%d %H:%M:%S%z")]
-            )
 
-    return csv_buffer.getvalue()
+def process_jsonl_file_parquet(file_key, target_key):
+    response = s3.get_object(Bucket=GA_BUCKET_NAME, Key=file_key)
+    deduplicator = ViewEventDeduplicator(GA_DEDUP_MAX_KEYS)
+
+    with S3MultipartWriter(TMP_BUCKET_NAME, target_key) as writer:
+        with pq.ParquetWriter(writer, VIEW_HISTORY_SCHEMA, compression="snappy") as parquet_writer:
+            user_ids, item_ids, event_timestamps = [], [], []
+            parsed = LineCounter()
+            events = RowCounter(get_view_events(extract_ga_body_events(file_key, response["Body"], parsed), deduplicator))
+            for user_id, item_id, event_timestamp in events:
+                user_ids.append(user_id)
+                item_ids.append(int(item_id))
+                # CSV (format_view_datetime) と同じく秒単位に切り捨てる
+                event_timestamps.append(int(event_timestamp) // 1000000 * 1000000)
+                if len(user_ids) >= GA_PARQUET_ROW_GROUP_SIZE:
+                    write_view_history_row_group(parquet_writer, user_ids, item_ids, event_timestamps)
+                    user_ids, item_ids, event_timestamps = [], [], []
+            if user_ids:
+                write_view_history_row_group(parquet_writer, user_ids, item_ids, event_timestamps)
+
+    return {"parsed": parsed.count, "rows": events.count, "dropped": deduplicator.dropped, "bytes_in": response["ContentLength"], "bytes_out": writer.tell()}
 
 
 def upload_to_s3(bucket_name, file_key, data):
     s3.put_object(Bucket=bucket_name, Key=file_key, Body=data)
 
 
-def load_to_rss(target_date):
-    with open("galoadsql/load_view_history.sql", "r") as f:
+def get_view_history_prefix(target_date):
+    return f"{target_date.strftime('%Y/%m/%d')}/view_history/"
+
+
+def write_copy_manifest(target_dates):
+    # 複数日の view_history を1回の COPY で取り込むためのマニフェスト。Parquet の場合は content_length が必須
+    entries = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for target_date in target_dates:
+        for page in paginator.paginate(Bucket=TMP_BUCKET_NAME, Prefix=get_view_history_prefix(target_date)):
+            for obj in page.get("Contents", []):
+                entries.append(
+                    {"url": f"s3://{TMP_BUCKET_NAME}/{obj['Key']}", "mandatory": True, "meta": {"content_length": obj["Size"]}}
+                )
+    manifest_key = f"backfill/{target_dates[0].strftime('%Y%m%d')}-{target_dates[-1].strftime('%Y%m%d')}/view_history.manifest"
+    s3.put_object(Bucket=TMP_BUCKET_NAME, Key=manifest_key, Body=json.dumps({"entries": entries}))
+    print(f"Wrote COPY manifest with {len(entries)} files: {TMP_BUCKET_NAME}/{manifest_key}")
+    return f"s3://{TMP_BUCKET_NAME}/{manifest_key}"
+
+
+def has_view_summary():
+    # Personalize の view_daily_summary (PERSONALIZE_USE_VIEW_SUMMARY) を利用している環境か
+    result = rs_executor.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = 'view_daily_summary_dates'", "view_summary check"
+    )
+    return int(rs_executor.fetch_records(result["Id"])[0][0]) > 0
+
+
+def get_load_sql(target_dates, copy_from, copy_format, load_strategy=GA_LOAD_STRATEGY, invalidate_summary=False):
+    sql_file_path = "galoadsql/load_view_history.sql"
+    if load_strategy == "replace":
+        sql_file_path = "galoadsql/load_view_history_replace.sql"
+    with open(sql_file_path, "r") as f:
         sql_template = f.read()
-    params = {"bucket_name": TMP_BUCKET_NAME, "iam_role": REDSHIFT_ROLE_ARN, "date": target_date.strftime("%Y/%m/%d"), "region": REGION}
+    params = {
+        "copy_from": copy_from,
+        "iam_role": REDSHIFT_ROLE_ARN,
+        "region": REGION,
+        "copy_format": copy_format,
+        # 置き換え対象の範囲 (対象日の JST 0時から最終日の翌日 0時まで)
+        "window_start": f"{target_dates[0]} 00:00:00+09:00",
+        "window_end": f"{target_dates[-1] + timedelta(days=1)} 00:00:00+09:00",
+        "summary_invalidation": "",
+    }
+    if invalidate_summary:
+        # 取り込んだ行の日 (対象日の範囲外も含む) を未集計に戻し、次の Personalize の実行で集計し直させる
+        params["summary_invalidation"] = """DELETE FROM view_daily_summary_dates
+WHERE view_date IN (SELECT DISTINCT TRUNC(view_datetime) FROM view_history_temp);"""
+    return sql_template.format(**params)
+
+
+def load_to_rss(target_dates):
+    copy_format = "FORMAT AS PARQUET" if GA_OUTPUT_FORMAT == "parquet" else "CSV"
+    if len(target_dates) == 1:
+        copy_from = f"s3://{TMP_BUCKET_NAME}/{get_view_history_prefix(target_dates[0])}"
+    else:
+        copy_from = write_copy_manifest(target_dates)
+        copy_format += "\nMANIFEST"
 
-    sql = sql_template.format(**params)
+    sql = get_load_sql(target_dates, copy_from, copy_format, invalidate_summary=has_view_summary())
 
-    response = rs.execute_statement(Database=REDSHIFT_DATABASENAME, Sql=sql, WorkgroupName=REDSHIFT_WORKGROUP)
-    return response["Id"]
+    return rs_executor.submit(sql, "view_history")
 
 
 def check_query_status(query_id):
-    while True:
-        response = rs.describe_statement(Id=query_id)
-        status = response["Status"]
-        if status == "FINISHED":
-            print(f"COPY command for query ID {query_id} completed successfully.")
-            break
-        elif status in ["FAILED", "ABORTED"]:
-            print(f"COPY command for query ID {query_id} failed with status: {status}")
-            print(f"Error message: {response.get('Error', 'No error message available')}")
-            raise
-        else:
-            print(f"COPY command for query ID {query_id} is still running. Current status: {status}")
-            time.sleep(5)
-
-
-def load_ga_process(yesterday):
-    files = get_ga_s3_files(yesterday.strftime("%Y/%m/%d"))
-    print(f"GA: Found {len(files)} files to process.")
-    for index, file_key in enumerate(files, 1):
-        print(f"Processing file {index} of {len(files)}: {file_key}")
-        csv_data = process_jsonl_file(file_key)
-        target_key = f"{yesterday.strftime('%Y/%m/%d')}/view_history/{file_key.split('/')[-1]}.csv"
-        upload_to_s3(TMP_BUCKET_NAME, target_key, csv_data)
-        print(f"Uploaded processed data to S3: {TMP_BUCKET_NAME}/{target_key}")
-
-    query_id = load_to_rss(yesterday)
-    print(f"Initiated COPY command. Query ID: {query_id}")
-    check_query_status(query_id)
+    rs_executor.wait([query_id])
+    print(f"COPY command for query ID {query_id} completed successfully.")
+
+
+def get_view_history_key(file_key, target_date):
+    return f"{get_view_history_prefix(target_date)}{file_key.split('/')[-1]}.{GA_OUTPUT_FORMAT}"
+
+
+def convert_ga_file(file_key, target_key, parse_executor=None):
+    # 変換結果として行数・除去した行数・入出力のバイト数を返す
+    if GA_OUTPUT_FORMAT == "parquet":
+        return process_jsonl_file_parquet(file_key, target_key)
+    elif GA_STREAMING:
+        return process_jsonl_file_streaming(file_key, target_key)
+    csv_data, stats = process_jsonl_file(file_key, parse_executor)
+    data = csv_data.encode("utf-8")
+    upload_to_s3(TMP_BUCKET_NAME, target_key, data)
+    return {**stats, "bytes_out": len(data)}
+
+
+def add_ga_stats(span, stats):
+    # RowsParsed は view_item 以外も含むすべての行、RowsEmitted は重複除去前の view_item の行数
+    span.add("RowsParsed", stats["parsed"])
+    span.add("RowsEmitted", stats["rows"] + stats["dropped"])
+    span.add("RowsKept", stats["rows"])
+    span.add("RowsDropped", stats["dropped"])
+    span.add("BytesIn", stats["bytes_in"], "Bytes")
+    span.add("BytesOut", stats["bytes_out"], "Bytes")
+
+
+def process_ga_file(file_key, target_key, parse_executor=None):
+    with metrics.span("ga_file", FileKey=file_key) as span:
+        for attempt in range(1, GA_FILE_RETRIES + 1):
+            try:
+                stats = convert_ga_file(file_key, target_key, parse_executor)
+                break
+            except Exception as e:
+                if attempt == GA_FILE_RETRIES:
+                    raise
+                print(f"Failed to process {file_key} (attempt {attempt} of {GA_FILE_RETRIES}): {e}")
+                time.sleep(2**attempt)
+        span.add("Attempts", attempt)
+        add_ga_stats(span, stats)
+    return stats
+
+
+def record_ga_file(manifest, etags, file_key, target_key, stats):
+    manifest.set_ga_file(file_key, {"etag": etags.get(file_key), "target_key": target_key, **stats})
+
+
+def process_ga_files_concurrently(files, manifest, etags):
+    # ダウンロード/アップロードはスレッドプール、JSON のパースはプロセスプールで並列に実行する
+    parse_executor = None
+    if not GA_STREAMING and GA_OUTPUT_FORMAT == "csv":
+        parse_executor = ProcessPoolExecutor(max_workers=GA_PARSE_PROCESSES, mp_context=multiprocessing.get_context("fork"))
+        # スレッド起動後の fork を避けるため、ここでワーカープロセスを起動しておく
+        parse_executor.submit(int).result()
+
+    failures = {}
+    futures_target_keys = dict(files)
+    try:
+        with ThreadPoolExecutor(max_workers=GA_WORKERS) as io_executor:
+            futures = {
+                io_executor.submit(process_ga_file, file_key, target_key, parse_executor): file_key
+                for file_key, target_key in files
+            }
+            for index, future in enumerate(as_completed(futures), 1):
+                file_key = futures[future]
+                try:
+                    record_ga_file(manifest, etags, file_key, futures_target_keys[file_key], future.result())
+                    print(f"Processed file {index} of {len(files)}: {file_key}")
+                except Exception as e:
+                    failures[file_key] = e
+                    print(f"Failed to process file {index} of {len(files)}: {file_key}: {e}")
+    finally:
+        if parse_executor is not None:
+            parse_executor.shutdown()
+
+    if failures:
+        raise Exception(f"{len(failures)} of {len(files)} GA files failed: {', '.join(failures)}")
+
+
+def list_tmp_keys(prefix):
+    keys = set()
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=TMP_BUCKET_NAME, Prefix=prefix):
+        keys.update(obj["Key"] for obj in page.get("Contents", []))
+    return keys
+
+
+def get_tmp_prefix_size(prefix):
+    size = 0
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=TMP_BUCKET_NAME, Prefix=prefix):
+        size += sum(obj["Size"] for obj in page.get("Contents", []))
+    return size
+
+
+def get_pending_ga_files(target_dates, files, etags, manifest):
+    outputs = set()
+    for target_date in target_dates:
+        outputs |= list_tmp_keys(get_view_history_prefix(target_date))
+
+    # GA ファイルが作り直されてファイル名が変わった場合、前回の出力が COPY で重複して取り込まれないよう削除する
+    stale = outputs - {target_key for _, target_key in files}
+    if stale:
+        print(f"GA: Deleting {len(stale)} view_history files that no longer match a GA file.")
+        delete_keys(s3, TMP_BUCKET_NAME, stale)
+
+    # ETag が前回の変換時から変わっておらず、出力ファイルも残っている GA ファイルは変換済みとして読み飛ばす
+    pending = []
+    for file_key, target_key in files:
+        entry = manifest.get_ga_file(file_key)
+        if entry and entry["etag"] == etags.get(file_key) and entry["target_key"] == target_key and target_key in outputs:
+            continue
+        pending.append((file_key, target_key))
+    return pending
+
+
+def load_ga_process(target_dates, manifest):
+    # 複数日の場合も全日のファイルをまとめて変換し、1回の COPY で取り込む
+    files = []
+    etags = {}
+    for target_date in target_dates:
+        date_files = get_ga_s3_files(target_date)
+        etags.update(date_files)
+        print(f"GA: Found {len(date_files)} files to process for {target_date}.")
+        files.extend((file_key, get_view_history_key(file_key, target_date)) for file_key in date_files)
+
+    with metrics.span("ga_transform") as span:
+        pending = get_pending_ga_files(target_dates, files, etags, manifest)
+        span.add("Files", len(pending))
+        span.add("FilesSkipped", len(files) - len(pending))
+        if len(pending) < len(files):
+            print(f"GA: Skipping {len(files) - len(pending)} files converted in a previous attempt.")
+        if pending:
+            # 変換し直したファイルがある場合は COPY もやり直す
+            manifest.set_ga_loaded(False)
+            try:
+                if GA_WORKERS > 1:
+                    process_ga_files_concurrently(pending, manifest, etags)
+                else:
+                    for index, (file_key, target_key) in enumerate(pending, 1):
+                        print(f"Processing file {index} of {len(pending)}: {file_key}")
+                        record_ga_file(manifest, etags, file_key, target_key, process_ga_file(file_key, target_key))
+                        print(f"Uploaded processed data to S3: {TMP_BUCKET_NAME}/{target_key}")
+            finally:
+                # 失敗した場合も、変換が完了したファイルを再実行時に読み飛ばせるよう保存する
+                manifest.flush()
+        for file_key, _ in pending:
+            add_ga_stats(span, manifest.get_ga_file(file_key))
+    if GA_DEDUP:
+        print(f"GA: Dropped {sum(manifest.get_ga_file(file_key)['dropped'] for file_key, _ in pending)} duplicate view_item rows.")
+    print(f"GA: {sum(manifest.get_ga_file(file_key)['rows'] for file_key, _ in files)} view_item rows in {len(files)} files.")
+
+    if manifest.is_ga_loaded():
+        print("GA: view_history was loaded in a previous attempt. Skipping COPY.")
+        return
+    with metrics.span("ga_copy", Files=len(files)):
+        query_id = load_to_rss(target_dates)
+        print(f"Initiated COPY command. Query ID: {query_id}")
+        check_query_status(query_id)
+    manifest.set_ga_loaded(True)
+
+
+# 分割に使う列と種類。uuid は値の空間を、それ以外は最小値から最大値までを均等に分割する
+AURORA_CHUNK_KEYS = {
+    "user_master": ("user_id", "uuid"),
+    "user_interest": ("user_id", "uuid"),
+    "item_master": ("item_id", "number"),
+    "purchase_history": ("purchase_datetime", "timestamp"),
+}
+
+
+def get_export_chunk_counts():
+    chunk_counts = {}
+    for item in AURORA_EXPORT_CHUNKS.split(","):
+        if not item.strip():
+            continue
+        table_name, count = item.split("=")
+        table_name = table_name.strip()
+        if table_name not in AURORA_CHUNK_KEYS:
+            raise ValueError(f"AURORA_EXPORT_CHUNKS: {table_name} cannot be split. Available tables: {', '.join(AURORA_CHUNK_KEYS)}")
+        chunk_counts[table_name] = max(1, int(count))
+    return chunk_counts
+
+
+export_chunk_counts = get_export_chunk_counts()
+
+
+def get_chunk_boundaries(table_name, chunks, min_date=None):
+    # 各チャンクの下限となる値を返す (先頭のチャンクは下限なし)
+    column, kind = AURORA_CHUNK_KEYS[table_name]
+    if kind == "uuid":
+        return [uuid.UUID(int=(i << 128) // chunks) for i in range(1, chunks)]
+
+    where = f"WHERE {column} >= '{min_date}'" if kind == "timestamp" and min_date else ""
+    with db_cursor() as conn:
+        low, high = exec_sql(conn, f"SELECT MIN({column}), MAX({column}) FROM {table_name} {where}", {}).fetchone()
+    if low is None:
+        return []
+    if kind == "number":
+        return sorted({low + (high - low + 1) * i // chunks for i in range(1, chunks)})
+    return sorted({low + (high - low) * i / chunks for i in range(1, chunks)})
+
+
+def get_export_chunks(table_name, min_date=None):
+    # (export するクエリに追加する条件, 出力ファイル名の接尾辞) のリスト。条件はクエリの文字列リテラル内に入るため引用符を重ねる
+    chunks = export_chunk_counts.get(table_name, 1)
+    boundaries = get_chunk_boundaries(table_name, chunks, min_date) if chunks > 1 else []
+    if not boundaries:
+        return [("TRUE", "")]
+
+    column, kind = AURORA_CHUNK_KEYS[table_name]
+    literals = [str(value) if kind == "number" else f"''{value}''" for value in boundaries]
+    ranges = list(zip([None] + literals, literals + [None]))
+    export_chunks = []
+    for index, (lower, upper) in enumerate(ranges):
+        conditions = []
+        if lower is not None:
+            conditions.append(f"{column} >= {lower}")
+        if upper is not None:
+            conditions.append(f"{column} < {upper}")
+        export_chunks.append((" AND ".join(conditions), f".part{index:03d}"))
+    return export_chunks
+
+
+def export_chunk(sql):
+    # コネクションプールを使い切らないよう、同時に実行する export の数を制限する
+    with export_slots:
+        with db_cursor() as conn:
+            # query_export_to_s3 は (rows_uploaded, files_uploaded, bytes_uploaded) を返す
+            return exec_sql(conn, sql, {}).fetchone()[0]
 
 
 def dump_from_aurora(sql_file_path, table_name, target_date, params=None):
@@ -122,14 +643,21 @@ def dump_from_aurora(sql_file_path, table_name, target_date, params=None):
     params["date"] = target_date.strftime("%Y/%m/%d")
     params["region"] = REGION
 
-    sql = sql_template.format(**params)
-
-    with db_cursor() as conn:
-        exec_sql(conn, sql, params)
+    # 前回の実行で分割数が異なる出力が残っていると COPY で重複して取り込まれるため、先に削除する
+    delete_prefix(s3, TMP_BUCKET_NAME, f"{params['date']}/{table_name}/")
+    chunks = get_export_chunks(table_name, params.get("min_date"))
+    sqls = [sql_template.format(**params, chunk_filter=chunk_filter, part_suffix=part_suffix) for chunk_filter, part_suffix in chunks]
+    if len(sqls) == 1:
+        rows = export_chunk(sqls[0])
+    else:
+        print(f"Exporting {table_name} in {len(sqls)} chunks")
+        with ThreadPoolExecutor(max_workers=len(sqls)) as executor:
+            rows = sum(future.result() for future in [executor.submit(export_chunk, sql) for sql in sqls])
 
+    # COPY は {table_name}.csv をプレフィックスとして扱うため、分割した各ファイルが並列に取り込まれる
     s3_path = f"s3://{TMP_BUCKET_NAME}/{params['date']}/{table_name}/"
-    print(f"Data exported to {s3_path}{table_name}.csv")
-    return s3_path
+    print(f"Data exported to {s3_path}{table_name}.csv ({rows} rows, {len(sqls)} chunks)")
+    return s3_path, rows
 
 
 def load_to_rss_dataloader(sql_file_path, table_name, s3_path, target_date, params=None):
@@ -146,8 +674,7 @@ def load_to_rss_dataloader(sql_file_path, table_name, s3_path, target_date, para
     params["region"] = REGION
     sql = sql_template.format(**params)
 
-    response = rs.execute_statement(Database=REDSHIFT_DATABASENAME, Sql=sql, WorkgroupName=REDSHIFT_WORKGROUP)
-    query_id = response["Id"]
+    query_id = rs_executor.submit(sql, table_name)
 
     print(f"Data for {table_name} loading to Redshift. Execution ID: {query_id}")
     check_query_status(query_id)
@@ -155,58 +682,203 @@ def load_to_rss_dataloader(sql_file_path, table_name, s3_path, target_date, para
 
 
 def makesure_empty(target_date):
-    s3pathprefix = target_date.strftime("%Y/%m/%d")
-    paginator = s3.get_paginator("list_objects_v2")
-    pages = paginator.paginate(Bucket=TMP_BUCKET_NAME, Prefix=s3pathprefix)
+    delete_prefix(s3, TMP_BUCKET_NAME, target_date.strftime("%Y/%m/%d"))
 
-    delete_list = []
-    for page in pages:
-        if "Contents" in page:
-            for obj in page["Contents"]:
-                delete_list.append({"Key": obj["Key"]})
 
-    if delete_list:
-        s3.delete_objects(Bucket=TMP_BUCKET_NAME, Delete={"Objects": delete_list})
+AURORA_TABLES = ["user_master", "interest_master", "item_master", "campaign", "user_interest", "purchase_history"]
+# min_date 以降に更新された行のみを dump するテーブル
+AURORA_MIN_DATE_TABLES = ["user_master", "purchase_history"]
+# AURORA_EXTRACT_MODE=incremental の場合に updated_at の high-water mark 以降の行のみを dump するテーブル
+AURORA_WATERMARK_TABLES = ["interest_master", "item_master", "campaign", "user_interest"]
+# 全件の dump で Redshift のテーブルを入れ替えるテーブル (それ以外は MERGE で取り込む)
+AURORA_REPLACE_TABLES = ["interest_master", "item_master", "campaign"]
 
-    print(f"Deleted {len(delete_list)} objects from {TMP_BUCKET_NAME}/{s3pathprefix}")
 
+def get_watermark_key(table_name):
+    # 日付プレフィックスの外に保存し、makesure_empty で削除されないようにする
+    return f"watermarks/{table_name}.json"
 
-def load_aurora_process(yesterday):
 
-    s3_paths = {}
+def load_watermark(table_name):
+    try:
+        response = s3.get_object(Bucket=TMP_BUCKET_NAME, Key=get_watermark_key(table_name))
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(response["Body"].read())["watermark"]
 
-    s3_paths["user_master"] = dump_from_aurora(
-        "dumpsql/dump_user_master.sql", "user_master", yesterday, {"min_date": yesterday.strftime("%Y-%m-%d")}
-    )
-    s3_paths["interest_master"] = dump_from_aurora("dumpsql/dump_interest_master.sql", "interest_master", yesterday)
-    s3_paths["item_master"] = dump_from_aurora("dumpsql/dump_item_master.sql", "item_master", yesterday)
-    s3_paths["campaign"] = dump_from_aurora("dumpsql/dump_campaign.sql", "campaign", yesterday)
-    s3_paths["user_interest"] = dump_from_aurora("dumpsql/dump_user_interest.sql", "user_interest", yesterday)
-    s3_paths["purchase_history"] = dump_from_aurora(
-        "dumpsql/dump_purchase_history.sql", "purchase_history", yesterday, {"min_date": yesterday.strftime("%Y-%m-%d")}
+
+def save_watermark(table_name, watermark):
+    body = json.dumps({"table_name": table_name, "watermark": watermark})
+    s3.put_object(Bucket=TMP_BUCKET_NAME, Key=get_watermark_key(table_name), Body=body)
+    print(f"Saved watermark for {table_name}: {watermark}")
+
+
+def get_aurora_now():
+    with db_cursor() as conn:
+        return exec_sql(conn, "SELECT now()", {}).scalar()
+
+
+def is_full_extract_day(target_date):
+    return target_date.weekday() == AURORA_FULL_EXTRACT_WEEKDAY
+
+
+def dump_table(table_name, target_date, min_date):
+    dump = {"incremental": False, "watermark": None}
+    params = None
+    if table_name in AURORA_MIN_DATE_TABLES:
+        params = {"min_date": min_date.strftime("%Y-%m-%d")}
+
+    if AURORA_EXTRACT_MODE == "incremental" and table_name in AURORA_WATERMARK_TABLES:
+        # 実行中のトランザクションによる更新を取りこぼさないよう、次回の watermark は重複を持たせて記録する
+        dump["watermark"] = (get_aurora_now() - AURORA_WATERMARK_OVERLAP).isoformat()
+        watermark = load_watermark(table_name)
+        if watermark and is_full_extract_day(target_date):
+            print(f"Dumping all rows of {table_name} to apply rows deleted in Aurora")
+        elif watermark:
+            dump["incremental"] = True
+            print(f"Dumping {table_name} rows updated since {watermark}")
+            dump["s3_path"], dump["rows"] = dump_from_aurora(
+                f"dumpsql/incremental/dump_{table_name}.sql", table_name, target_date, {"watermark": watermark}
+            )
+            return dump
+
+    dump["s3_path"], dump["rows"] = dump_from_aurora(
+        f"dumpsql/dump_{table_name}.sql", table_name, target_date, params
     )
+    return dump
+
+
+def load_table(table_name, dump, target_date):
+    # MERGE で取り込む dump が0件の場合は、COPY (出力ファイルがなく失敗する) と watermark の更新を行わない
+    if dump.get("rows") == 0 and (dump["incremental"] or table_name not in AURORA_REPLACE_TABLES):
+        print(f"No rows to load for {table_name}. Skipping load.")
+        return
+
+    sql_file_path = f"loadsql/load_{table_name}.sql"
+    if dump["incremental"] and os.path.exists(f"loadsql/incremental/load_{table_name}.sql"):
+        sql_file_path = f"loadsql/incremental/load_{table_name}.sql"
+    load_to_rss_dataloader(sql_file_path, table_name, dump["s3_path"], target_date)
+
+    if dump["watermark"]:
+        save_watermark(table_name, dump["watermark"])
+
+
+def dump_table_once(table_name, target_date, min_date, manifest):
+    # 前回の実行で dump 済みで、出力ファイルが残っている場合は dump し直さない
+    status = manifest.get_table(table_name)
+    dump = status.get("dump")
+    # 0件の dump は出力ファイルがないため、行数で dump 済みかを判定する
+    dumped = dump and (dump.get("rows") == 0 or list_tmp_keys(f"{target_date.strftime('%Y/%m/%d')}/{table_name}/"))
+    if status.get("loaded") or dumped:
+        print(f"Skipping dump of {table_name} (dumped in a previous attempt)")
+        return status["dump"]
+    with metrics.span(f"aurora_dump:{table_name}") as span:
+        dump = dump_table(table_name, target_date, min_date)
+        span.add("Rows", dump["rows"])
+        span.add("BytesOut", get_tmp_prefix_size(f"{target_date.strftime('%Y/%m/%d')}/{table_name}/"), "Bytes")
+    manifest.update_table(table_name, dump=dump, loaded=False)
+    return dump
+
+
+def load_table_once(table_name, dump, target_date, manifest):
+    if manifest.get_table(table_name).get("loaded"):
+        print(f"Skipping load of {table_name} (loaded in a previous attempt)")
+        return
+    with metrics.span(f"aurora_load:{table_name}", Incremental=dump["incremental"]):
+        load_table(table_name, dump, target_date)
+    manifest.update_table(table_name, loaded=True)
+
+
+def run_dag(tasks, max_workers):
+    # tasks は {タスク名: (関数, 依存するタスク名のリスト)}。依存先が全て完了したタスクから順に実行する
+    done = set()
+    failures = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            if not failures:
+                for name, (func, depends_on) in tasks.items():
+                    if name not in done and name not in running.values() and all(d in done for d in depends_on):
+                        running[executor.submit(func)] = name
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    done.add(name)
+                except Exception as e:
+                    failures[name] = e
+                    print(f"Task {name} failed: {e}")
+
+    if failures:
+        raise Exception(f"{len(failures)} tasks failed: {', '.join(failures)}")
+    if len(done) != len(tasks):
+        raise Exception(f"Tasks with unresolved dependencies: {', '.join(name for name in tasks if name not in done)}")
+
+
+def load_aurora_process_concurrently(yesterday, min_date, manifest):
+    # テーブルごとに dump が終わり次第、そのテーブルの load を開始する
+    dumps = {}
+
+    def dump(table_name):
+        dumps[table_name] = dump_table_once(table_name, yesterday, min_date, manifest)
+
+    def load(table_name):
+        load_table_once(table_name, dumps[table_name], yesterday, manifest)
+
+    tasks = {}
+    for table_name in AURORA_TABLES:
+        tasks[f"dump:{table_name}"] = (partial(dump, table_name), [])
+        tasks[f"load:{table_name}"] = (partial(load, table_name), [f"dump:{table_name}"])
+
+    run_dag(tasks, AURORA_WORKERS)
+    print("All dumps and loads completed.")
+
+
+def load_aurora_process(yesterday, manifest, min_date=None):
+    # min_date 以降に更新された行を dump する (バックフィルの場合は開始日)
+    min_date = min_date or yesterday
+    if AURORA_WORKERS > 1:
+        load_aurora_process_concurrently(yesterday, min_date, manifest)
+        return
+
+    dumps = {}
+    for table_name in AURORA_TABLES:
+        dumps[table_name] = dump_table_once(table_name, yesterday, min_date, manifest)
 
     print("All dumps completed.")
 
-    load_to_rss_dataloader("loadsql/load_user_master.sql", "user_master", s3_paths["user_master"], yesterday)
-    load_to_rss_dataloader("loadsql/load_interest_master.sql", "interest_master", s3_paths["interest_master"], yesterday)
-    load_to_rss_dataloader("loadsql/load_item_master.sql", "item_master", s3_paths["item_master"], yesterday)
-    load_to_rss_dataloader("loadsql/load_campaign.sql", "campaign", s3_paths["campaign"], yesterday)
-    load_to_rss_dataloader("loadsql/load_user_interest.sql", "user_interest", s3_paths["user_interest"], yesterday)
-    load_to_rss_dataloader("loadsql/load_purchase_history.sql", "purchase_history", s3_paths["purchase_history"], yesterday)
+    for table_name in AURORA_TABLES:
+        load_table_once(table_name, dumps[table_name], yesterday, manifest)
 
     print("All loads completed.")
 
 
-if __name__ == "__main__":
-    if TEST_DATE:
-        date_object = datetime.strptime(TEST_DATE, "%Y%m%d")
-        target_date = date_object.replace(tzinfo=JST).date()
-    else:
-        target_date = get_yesterday_date()
+def open_run_manifest(target_dates):
+    # 日付プレフィックスの外に保存し、makesure_empty で削除されないようにする
+    key = f"runs/{target_dates[0].strftime('%Y%m%d')}-{target_dates[-1].strftime('%Y%m%d')}/manifest.json"
+    manifest = RunManifest(s3, TMP_BUCKET_NAME, key, save_interval=RUN_MANIFEST_SAVE_FILES)
+    if DATALOADER_RESUME and manifest.load():
+        print(f"Resuming from run manifest: {TMP_BUCKET_NAME}/{key}")
+        return manifest
+
+    for target_date in target_dates:
+        makesure_empty(target_date)
+    manifest.save()
+    return manifest
 
-    makesure_empty(target_date)
-    print("## load_ga_process")
-    load_ga_process(target_date)
-    print("## load_aurora_process")
-    load_aurora_process(target_date)
+
+if __name__ == "__main__":
+    target_dates = get_target_dates()
+
+    with metrics.profile(), metrics.span("total", Days=len(target_dates)):
+        manifest = open_run_manifest(target_dates)
+        print("## load_ga_process")
+        load_ga_process(target_dates, manifest)
+        print("## load_aurora_process")
+        # マスタは最終日の状態を1回だけ取り込む
+        load_aurora_process(target_dates[-1], manifest, target_dates[0])
+        # 全て完了したら削除し、次に同じ日付で実行した場合は最初からやり直す
+        manifest.delete()
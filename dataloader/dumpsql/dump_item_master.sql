@@ -1,9 +1,10 @@
 SELECT aws_s3.query_export_to_s3(
     'SELECT item_id, item_name, price, item_category_id
-     FROM item_master',
+     FROM item_master
+     WHERE {chunk_filter}',
     aws_commons.create_s3_uri(
         '{bucket_name}',
-        '{date}/item_master/item_master.csv',
+        '{date}/item_master/item_master.csv{part_suffix}',
         '{region}'
     ),
     options :='format csv, header true'
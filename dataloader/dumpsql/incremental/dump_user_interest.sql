@@ -0,0 +1,12 @@
+SELECT aws_s3.query_export_to_s3(
+    'SELECT user_id, interest_id
+     FROM user_interest
+     WHERE updated_at >= ''{watermark}''
+     AND {chunk_filter}',
+    aws_commons.create_s3_uri(
+        '{bucket_name}',
+        '{date}/user_interest/user_interest.csv{part_suffix}',
+        '{region}'
+    ),
+    options :='format csv, header true'
+);
\ No newline at end of file
@@ -4,10 +4,10 @@ BEGIN TRANSACTION;
 CREATE TEMP TABLE view_history_temp
 (LIKE view_history);
 
-COPY view_history_temp (user_id, item_id, view_datetime)
-FROM 's3://{bucket_name}/{date}/view_history/'
+COPY view_history_temp
+FROM '{copy_from}'
 IAM_ROLE '{iam_role}'
-CSV;
+{copy_format};
 
 -- 重複除去
 CREATE TEMP TABLE view_history_deduped AS
@@ -26,5 +26,6 @@ WHERE NOT EXISTS (
     AND vh.view_datetime = vhd.view_datetime
 );
 
+{summary_invalidation}
 
 END TRANSACTION;
\ No newline at end of file
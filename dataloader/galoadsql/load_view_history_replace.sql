@@ -0,0 +1,39 @@
+BEGIN TRANSACTION;
+
+-- 一時テーブル
+CREATE TEMP TABLE view_history_temp
+(LIKE view_history);
+
+COPY view_history_temp
+FROM '{copy_from}'
+IAM_ROLE '{iam_role}'
+{copy_format};
+
+-- 対象日 (JST) の既存行を削除して置き換える（再実行しても同じ結果になる）
+DELETE FROM view_history
+WHERE view_history.view_datetime >= '{window_start}'
+AND view_history.view_datetime < '{window_end}';
+
+-- 対象日の行を重複除去して INSERT
+INSERT INTO view_history (user_id, item_id, view_datetime)
+SELECT DISTINCT user_id, item_id, view_datetime
+FROM view_history_temp
+WHERE view_datetime >= '{window_start}'
+AND view_datetime < '{window_end}';
+
+-- 対象日の範囲外の行 (日付をまたいで記録されたイベント) は削除の対象外のため、既存行との重複を避けて追加する
+INSERT INTO view_history (user_id, item_id, view_datetime)
+SELECT DISTINCT vht.user_id, vht.item_id, vht.view_datetime
+FROM view_history_temp vht
+WHERE (vht.view_datetime < '{window_start}' OR vht.view_datetime >= '{window_end}')
+AND NOT EXISTS (
+    SELECT 1
+    FROM view_history vh
+    WHERE vh.user_id = vht.user_id
+    AND vh.item_id = vht.item_id
+    AND vh.view_datetime = vht.view_datetime
+);
+
+{summary_invalidation}
+
+END TRANSACTION;
\ No newline at end of file
@@ -0,0 +1,128 @@
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import pyarrow.parquet as pq
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JST = timezone(timedelta(hours=+9))
+
+# Glue の JSON 出力は区切りに空白を含まないが、念のため両方の表記を対象にする
+VIEW_ITEM_MARKERS = (b'"event_name":"view_item"', b'"event_name": "view_item"')
+# to_view_item が参照する列
+VIEW_ITEM_COLUMNS = ["event_name", "event_timestamp", "user_id", "user_pseudo_id", "items"]
+
+
+def to_view_item(event):
+    # view_item 以外は None、view_item の場合は (user_id, item_id, event_timestamp) を返す
+    if event["event_name"] != "view_item":
+        return None
+    user_id = event.get("user_id") or event.get("user_pseudo_id")
+    items = event.get("items") or [{}]
+    return user_id, items[0].get("item_id"), event["event_timestamp"]
+
+
+def parse_json(line):
+    return to_view_item(json.loads(line))
+
+
+def parse_prefilter(line):
+    # 生のバイト列に view_item が含まれない行は JSON としてデコードしない
+    if not any(marker in line for marker in VIEW_ITEM_MARKERS):
+        return None
+    return to_view_item(json.loads(line))
+
+
+def parse_orjson(line):
+    if not any(marker in line for marker in VIEW_ITEM_MARKERS):
+        return None
+    return to_view_item(orjson.loads(line))
+
+
+PARSERS = {
+    "json": parse_json,
+    "prefilter": parse_prefilter,
+    "orjson": parse_orjson,
+}
+
+
+def get_parser(name):
+    if name not in PARSERS:
+        raise ValueError(f"Unknown GA parser: {name}. Available parsers: {', '.join(PARSERS)}")
+    if name == "orjson" and orjson is None:
+        print("orjson is not installed. Falling back to the prefilter parser.")
+        return parse_prefilter
+    return PARSERS[name]
+
+
+def format_view_datetime(event_timestamp):
+    return datetime.fromtimestamp(event_timestamp / 1000000.0, tz=JST).strftime("%Y-%m-%d %H:%M:%S%z")
+
+
+class LineCounter:
+    # パースした行数 (view_item 以外のイベントも含む)。prefilter で読み飛ばした行も数える
+    def __init__(self):
+        self.count = 0
+
+
+def extract_view_events(lines, parser=parse_json, counter=None):
+    for line in lines:
+        if not line:
+            continue
+        if counter is not None:
+            counter.count += 1
+        view_item = parser(line)
+        if view_item is None:
+            continue
+        user_id, item_id, event_timestamp = view_item
+        if not user_id or not item_id:
+            return
+        yield user_id, item_id, event_timestamp
+
+
+def extract_parquet_view_events(source, batch_size=65536, counter=None):
+    # Glue が Parquet で出力した GA のイベントは JSON のデコードが不要なので、必要な列だけを読んで行ごとに判定する
+    parquet_file = pq.ParquetFile(source)
+    columns = [name for name in VIEW_ITEM_COLUMNS if name in parquet_file.schema_arrow.names]
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        if counter is not None:
+            counter.count += batch.num_rows
+        for event in batch.to_pylist():
+            view_item = to_view_item(event)
+            if view_item is None:
+                continue
+            user_id, item_id, event_timestamp = view_item
+            if not user_id or not item_id:
+                return
+            yield user_id, item_id, event_timestamp
+
+
+def to_csv_rows(events):
+    for user_id, item_id, event_timestamp in events:
+        yield [user_id, item_id, format_view_datetime(event_timestamp)]
+
+
+def extract_view_items(lines, parser=parse_json):
+    return to_csv_rows(extract_view_events(lines, parser))
+
+
+class ViewEventDeduplicator:
+    # 同一ユーザ・アイテム・秒の view_item を除去する。保持するキー数は max_keys までで、超えた場合は古いものから捨てる
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.seen = OrderedDict()
+        self.dropped = 0
+
+    def filter(self, events):
+        for user_id, item_id, event_timestamp in events:
+            key = (user_id, item_id, event_timestamp // 1000000)
+            if key in self.seen:
+                self.dropped += 1
+                continue
+            self.seen[key] = None
+            if len(self.seen) > self.max_keys:
+                self.seen.popitem(last=False)
+            yield user_id, item_id, event_timestamp
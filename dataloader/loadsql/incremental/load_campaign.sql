@@ -0,0 +1,24 @@
+BEGIN TRANSACTION;
+
+CREATE TEMP TABLE campaign_temp
+(LIKE campaign);
+
+COPY campaign_temp (campaign_id, campaign_name)
+FROM 's3://{bucket_name}/{date}/campaign/campaign.csv'
+IAM_ROLE '{role_arn}'
+REGION '{region}'
+FORMAT CSV
+IGNOREHEADER 1
+;
+
+MERGE INTO campaign
+USING campaign_temp
+ON campaign.campaign_id = campaign_temp.campaign_id
+WHEN MATCHED THEN
+    UPDATE SET
+    campaign_name = campaign_temp.campaign_name
+WHEN NOT MATCHED THEN
+    INSERT (campaign_id, campaign_name)
+    VALUES (campaign_temp.campaign_id, campaign_temp.campaign_name);
+
+END TRANSACTION;
\ No newline at end of file
@@ -0,0 +1,24 @@
+BEGIN TRANSACTION;
+
+CREATE TEMP TABLE interest_master_temp
+(LIKE interest_master);
+
+COPY interest_master_temp (interest_id, interest_name)
+FROM 's3://{bucket_name}/{date}/interest_master/interest_master.csv'
+IAM_ROLE '{role_arn}'
+REGION '{region}'
+FORMAT CSV
+IGNOREHEADER 1
+;
+
+MERGE INTO interest_master
+USING interest_master_temp
+ON interest_master.interest_id = interest_master_temp.interest_id
+WHEN MATCHED THEN
+    UPDATE SET
+    interest_name = interest_master_temp.interest_name
+WHEN NOT MATCHED THEN
+    INSERT (interest_id, interest_name)
+    VALUES (interest_master_temp.interest_id, interest_master_temp.interest_name);
+
+END TRANSACTION;
\ No newline at end of file
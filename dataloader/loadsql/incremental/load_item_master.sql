@@ -0,0 +1,26 @@
+BEGIN TRANSACTION;
+
+CREATE TEMP TABLE item_master_temp
+(LIKE item_master);
+
+COPY item_master_temp (item_id, item_name, price, item_category_id)
+FROM 's3://{bucket_name}/{date}/item_master/item_master.csv'
+IAM_ROLE '{role_arn}'
+REGION '{region}'
+FORMAT CSV
+IGNOREHEADER 1
+;
+
+MERGE INTO item_master
+USING item_master_temp
+ON item_master.item_id = item_master_temp.item_id
+WHEN MATCHED THEN
+    UPDATE SET
+    item_name = item_master_temp.item_name,
+    price = item_master_temp.price,
+    item_category_id = item_master_temp.item_category_id
+WHEN NOT MATCHED THEN
+    INSERT (item_id, item_name, price, item_category_id)
+    VALUES (item_master_temp.item_id, item_master_temp.item_name, item_master_temp.price, item_master_temp.item_category_id);
+
+END TRANSACTION;
\ No newline at end of file
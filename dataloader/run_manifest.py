@@ -0,0 +1,88 @@
+import json
+import threading
+
+
+class RunManifest:
+    # データローダーの実行ごとの進捗 (GA ファイルの変換結果、テーブルごとの dump / load の状態) を S3 に保存する
+    # 失敗した実行を再実行した場合に、完了済みの処理を読み飛ばすために使う
+    def __init__(self, client, bucket_name, key, save_interval=1):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        # GA ファイルの変換結果は save_interval 件ごとにまとめて保存する (残りは flush で保存する)
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.data = {"ga_files": {}, "ga_loaded": False, "tables": {}}
+        self.unsaved = 0
+        self.version = 0
+        self.saved_version = 0
+
+    def load(self):
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=self.key)
+        except self.client.exceptions.NoSuchKey:
+            return False
+        self.data = json.loads(response["Body"].read())
+        return True
+
+    def save(self):
+        with self.lock:
+            body, version = self._dump()
+        self._put(body, version)
+
+    def flush(self):
+        with self.lock:
+            if not self.unsaved:
+                return
+            body, version = self._dump()
+        self._put(body, version)
+
+    def _dump(self):
+        self.unsaved = 0
+        self.version += 1
+        return json.dumps(self.data), self.version
+
+    def _put(self, body, version):
+        # アップロードはロックの外で行い、他のスレッドが新しい内容を保存済みの場合は古い内容で上書きしない
+        with self.save_lock:
+            if version <= self.saved_version:
+                return
+            self.client.put_object(Bucket=self.bucket_name, Key=self.key, Body=body)
+            self.saved_version = version
+
+    def delete(self):
+        self.client.delete_object(Bucket=self.bucket_name, Key=self.key)
+
+    def get_ga_file(self, file_key):
+        with self.lock:
+            return self.data["ga_files"].get(file_key)
+
+    def set_ga_file(self, file_key, entry):
+        with self.lock:
+            self.data["ga_files"][file_key] = entry
+            self.unsaved += 1
+            if self.unsaved < self.save_interval:
+                return
+            body, version = self._dump()
+        self._put(body, version)
+
+    def is_ga_loaded(self):
+        with self.lock:
+            return self.data["ga_loaded"]
+
+    def set_ga_loaded(self, loaded):
+        with self.lock:
+            self.data["ga_loaded"] = loaded
+            body, version = self._dump()
+        self._put(body, version)
+
+    def get_table(self, table_name):
+        with self.lock:
+            return dict(self.data["tables"].get(table_name, {}))
+
+    def update_table(self, table_name, **values):
+        with self.lock:
+            self.data["tables"].setdefault(table_name, {}).update(values)
+            body, version = self._dump()
+        self._put(body, version)
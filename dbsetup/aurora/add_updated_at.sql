@@ -0,0 +1,25 @@
+-- 既存環境向け: 差分抽出(AURORA_EXTRACT_MODE=incremental)のために updated_at 列とトリガーを追加します
+
+\c ecdb
+
+ALTER TABLE interest_master ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE item_master ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE campaign ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE user_interest ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_interest_master_updated_at ON interest_master (updated_at);
+CREATE INDEX IF NOT EXISTS idx_item_master_updated_at ON item_master (updated_at);
+CREATE INDEX IF NOT EXISTS idx_campaign_updated_at ON campaign (updated_at);
+CREATE INDEX IF NOT EXISTS idx_user_interest_updated_at ON user_interest (updated_at);
+
+CREATE OR REPLACE FUNCTION set_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_interest_master_updated_at BEFORE UPDATE ON interest_master FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+CREATE OR REPLACE TRIGGER trg_item_master_updated_at BEFORE UPDATE ON item_master FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+CREATE OR REPLACE TRIGGER trg_campaign_updated_at BEFORE UPDATE ON campaign FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+CREATE OR REPLACE TRIGGER trg_user_interest_updated_at BEFORE UPDATE ON user_interest FOR EACH ROW EXECUTE FUNCTION set_updated_at();
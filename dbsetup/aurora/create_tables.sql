@@ -13,7 +13,8 @@ CREATE EXTENSION aws_s3 CASCADE;
 -- 興味マスタ
 CREATE TABLE IF NOT EXISTS interest_master (
     interest_id BIGSERIAL PRIMARY KEY,
-    interest_name TEXT NOT NULL
+    interest_name TEXT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
 -- ユーザマスタ
@@ -30,6 +31,7 @@ CREATE TABLE IF NOT EXISTS user_master (
 CREATE TABLE IF NOT EXISTS user_interest (
     user_id UUID REFERENCES user_master(user_id),
     interest_id BIGINT REFERENCES interest_master(interest_id),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY (user_id, interest_id)
 );
 
@@ -38,13 +40,15 @@ CREATE TABLE IF NOT EXISTS item_master (
     item_id BIGSERIAL PRIMARY KEY,
     item_name TEXT NOT NULL,
     price FLOAT NOT NULL,
-    item_category_id BIGINT REFERENCES interest_master(interest_id)
+    item_category_id BIGINT REFERENCES interest_master(interest_id),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
 -- campaign 
 CREATE TABLE IF NOT EXISTS campaign (
     campaign_id BIGSERIAL PRIMARY KEY,
-    campaign_name TEXT NOT NULL
+    campaign_name TEXT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
 -- 購買履歴
@@ -64,4 +68,24 @@ CREATE TABLE IF NOT EXISTS purchase_history (
 CREATE INDEX IF NOT EXISTS idx_purchase_history_datetime ON purchase_history (purchase_datetime);
 
 -- 2. ユーザ興味テーブルのユーザIDに対するインデックス
-CREATE INDEX IF NOT EXISTS idx_user_interest_user ON user_interest (user_id);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_user_interest_user ON user_interest (user_id);
+
+-- 3. 差分抽出(updated_at の high-water mark)のためのインデックス
+CREATE INDEX IF NOT EXISTS idx_interest_master_updated_at ON interest_master (updated_at);
+CREATE INDEX IF NOT EXISTS idx_item_master_updated_at ON item_master (updated_at);
+CREATE INDEX IF NOT EXISTS idx_campaign_updated_at ON campaign (updated_at);
+CREATE INDEX IF NOT EXISTS idx_user_interest_updated_at ON user_interest (updated_at);
+
+
+-- 更新時に updated_at を自動で更新するトリガー
+CREATE OR REPLACE FUNCTION set_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_interest_master_updated_at BEFORE UPDATE ON interest_master FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+CREATE OR REPLACE TRIGGER trg_item_master_updated_at BEFORE UPDATE ON item_master FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+CREATE OR REPLACE TRIGGER trg_campaign_updated_at BEFORE UPDATE ON campaign FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+CREATE OR REPLACE TRIGGER trg_user_interest_updated_at BEFORE UPDATE ON user_interest FOR EACH ROW EXECUTE FUNCTION set_updated_at();
\ No newline at end of file
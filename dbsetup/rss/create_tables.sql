@@ -1,62 +1,117 @@
 
 -- 興味マスタ
 CREATE TABLE IF NOT EXISTS interest_master (
-    interest_id BIGINT NOT NULL,
-    interest_name VARCHAR(1024) NOT NULL
-);
+    interest_id BIGINT NOT NULL ENCODE AZ64,
+    interest_name VARCHAR(1024) NOT NULL ENCODE ZSTD
+)
+DISTSTYLE ALL;
 GRANT SELECT, INSERT, UPDATE, DELETE ON interest_master TO PUBLIC;
 
 -- ユーザマスタ
 CREATE TABLE IF NOT EXISTS user_master (
-    user_id CHAR(64) PRIMARY KEY,
-    email CHAR(256) NOT NULL,
-    gender VARCHAR(64) NOT NULL,
-    age INTEGER NOT NULL,
-    created_at TIMESTAMP,
-    updated_at TIMESTAMP
-);
+    user_id VARCHAR(64) NOT NULL ENCODE RAW,
+    email VARCHAR(256) NOT NULL ENCODE ZSTD,
+    gender VARCHAR(64) NOT NULL ENCODE ZSTD,
+    age INTEGER NOT NULL ENCODE AZ64,
+    created_at TIMESTAMP ENCODE AZ64,
+    updated_at TIMESTAMP ENCODE AZ64,
+    PRIMARY KEY (user_id)
+)
+DISTKEY (user_id)
+SORTKEY (user_id);
 GRANT SELECT, INSERT, UPDATE, DELETE ON user_master TO PUBLIC;
 
 
 -- ユーザ興味 & Item Category
 CREATE TABLE IF NOT EXISTS user_interest (
-    user_id CHAR(64),
-    interest_id BIGINT
-);
+    user_id VARCHAR(64) ENCODE RAW,
+    interest_id BIGINT ENCODE AZ64
+)
+DISTKEY (user_id)
+SORTKEY (user_id);
 GRANT SELECT, INSERT, UPDATE, DELETE ON user_interest TO PUBLIC;
 
 
 -- アイテムマスタ
 CREATE TABLE IF NOT EXISTS item_master (
-    item_id BIGINT,
-    item_name VARCHAR(1024) NOT NULL,
-    price FLOAT NOT NULL,
-    item_category_id BIGINT
-);
+    item_id BIGINT ENCODE AZ64,
+    item_name VARCHAR(1024) NOT NULL ENCODE ZSTD,
+    price FLOAT NOT NULL ENCODE ZSTD,
+    item_category_id BIGINT ENCODE AZ64
+)
+DISTSTYLE ALL;
 GRANT SELECT, INSERT, UPDATE, DELETE ON item_master TO PUBLIC;
 
 
 -- campaign 
 CREATE TABLE IF NOT EXISTS campaign (
-    campaign_id BIGINT,
-    campaign_name VARCHAR(1024) NOT NULL
-);
+    campaign_id BIGINT ENCODE AZ64,
+    campaign_name VARCHAR(1024) NOT NULL ENCODE ZSTD
+)
+DISTSTYLE ALL;
 GRANT SELECT, INSERT, UPDATE, DELETE ON campaign TO PUBLIC;
 
 
 -- 購買履歴
 CREATE TABLE IF NOT EXISTS purchase_history (
-    user_id CHAR(64),
-    item_id BIGINT,
-    campaign_id BIGINT,
-    purchase_datetime TIMESTAMPTZ
-);
+    user_id VARCHAR(64) ENCODE ZSTD,
+    item_id BIGINT ENCODE AZ64,
+    campaign_id BIGINT ENCODE AZ64,
+    purchase_datetime TIMESTAMPTZ ENCODE RAW
+)
+DISTKEY (user_id)
+COMPOUND SORTKEY (purchase_datetime);
 GRANT SELECT, INSERT, UPDATE, DELETE ON purchase_history TO PUBLIC;
 
 -- 閲覧履歴(GAからのImport)
 CREATE TABLE IF NOT EXISTS view_history (
-    user_id CHAR(64),
-    item_id BIGINT,
-    view_datetime TIMESTAMPTZ
-);
+    user_id VARCHAR(64) ENCODE ZSTD,
+    item_id BIGINT ENCODE AZ64,
+    view_datetime TIMESTAMPTZ ENCODE RAW
+)
+DISTKEY (user_id)
+COMPOUND SORTKEY (view_datetime);
 GRANT SELECT, INSERT, UPDATE, DELETE ON view_history TO PUBLIC;
+
+-- 閲覧履歴の日次集計(Personalize のユーザ・アイテム抽出用)
+CREATE TABLE IF NOT EXISTS view_daily_summary (
+    view_date DATE ENCODE RAW,
+    user_id VARCHAR(64) ENCODE ZSTD,
+    item_id BIGINT ENCODE AZ64,
+    first_view TIMESTAMPTZ ENCODE AZ64,
+    last_view TIMESTAMPTZ ENCODE AZ64,
+    view_count BIGINT ENCODE AZ64
+)
+DISTKEY (user_id)
+COMPOUND SORTKEY (view_date);
+GRANT SELECT, INSERT, UPDATE, DELETE ON view_daily_summary TO PUBLIC;
+
+-- view_daily_summary を集計済みの日 (閲覧が0件の日も含む)
+CREATE TABLE IF NOT EXISTS view_daily_summary_dates (
+    view_date DATE ENCODE RAW
+)
+DISTSTYLE ALL
+SORTKEY (view_date);
+GRANT SELECT, INSERT, UPDATE, DELETE ON view_daily_summary_dates TO PUBLIC;
+
+
+-- Pinpoint に最後にエクスポートしたエンドポイント属性のハッシュ
+CREATE TABLE IF NOT EXISTS pinpoint_endpoint_snapshot (
+    user_id VARCHAR(64) ENCODE RAW,
+    attr_hash CHAR(32) ENCODE ZSTD
+)
+DISTKEY (user_id)
+SORTKEY (user_id);
+GRANT SELECT, INSERT, UPDATE, DELETE ON pinpoint_endpoint_snapshot TO PUBLIC;
+
+CREATE TABLE IF NOT EXISTS pinpoint_endpoint_stage (
+    user_id VARCHAR(64) ENCODE RAW,
+    email VARCHAR(256) ENCODE ZSTD,
+    gender VARCHAR(64) ENCODE ZSTD,
+    age INTEGER ENCODE AZ64,
+    interest_name VARCHAR(1024) ENCODE ZSTD,
+    attr_hash CHAR(32) ENCODE ZSTD
+)
+DISTKEY (user_id)
+SORTKEY (user_id);
+GRANT SELECT, INSERT, UPDATE, DELETE ON pinpoint_endpoint_stage TO PUBLIC;
@@ -0,0 +1,3 @@
+-- view_history の日付範囲での置き換え(GA_LOAD_STRATEGY=replace)のため、ソートキーと分散キーを設定する
+ALTER TABLE view_history ALTER DISTKEY user_id;
+ALTER TABLE view_history ALTER COMPOUND SORTKEY (view_datetime);
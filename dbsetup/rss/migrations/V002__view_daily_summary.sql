@@ -0,0 +1,20 @@
+-- Personalize のユーザ・アイテム抽出(PERSONALIZE_USE_VIEW_SUMMARY=true)で利用する閲覧履歴の日次集計テーブル
+CREATE TABLE IF NOT EXISTS view_daily_summary (
+    view_date DATE,
+    user_id CHAR(64),
+    item_id BIGINT,
+    first_view TIMESTAMPTZ,
+    last_view TIMESTAMPTZ,
+    view_count BIGINT
+)
+DISTKEY (user_id)
+COMPOUND SORTKEY (view_date);
+GRANT SELECT, INSERT, UPDATE, DELETE ON view_daily_summary TO PUBLIC;
+
+-- view_daily_summary を集計済みの日 (閲覧が0件の日も含む)
+CREATE TABLE IF NOT EXISTS view_daily_summary_dates (
+    view_date DATE
+)
+DISTSTYLE ALL
+SORTKEY (view_date);
+GRANT SELECT, INSERT, UPDATE, DELETE ON view_daily_summary_dates TO PUBLIC;
@@ -0,0 +1,20 @@
+-- Pinpoint の差分インポート(PINPOINT_EXPORT_MODE=diff)で利用するエンドポイント属性のスナップショット
+CREATE TABLE IF NOT EXISTS pinpoint_endpoint_snapshot (
+    user_id CHAR(64),
+    attr_hash CHAR(32)
+)
+DISTKEY (user_id)
+SORTKEY (user_id);
+GRANT SELECT, INSERT, UPDATE, DELETE ON pinpoint_endpoint_snapshot TO PUBLIC;
+
+CREATE TABLE IF NOT EXISTS pinpoint_endpoint_stage (
+    user_id CHAR(64),
+    email CHAR(256),
+    gender VARCHAR(64),
+    age INTEGER,
+    interest_name VARCHAR(1024),
+    attr_hash CHAR(32)
+)
+DISTKEY (user_id)
+SORTKEY (user_id);
+GRANT SELECT, INSERT, UPDATE, DELETE ON pinpoint_endpoint_stage TO PUBLIC;
@@ -0,0 +1,23 @@
+-- V002__view_daily_summary.sql を適用済みの環境のみ実行する。V004__table_design.sql と同じ設計に作り直す
+
+-- 閲覧履歴の日次集計
+BEGIN TRANSACTION;
+CREATE TABLE view_daily_summary_new (
+    view_date DATE ENCODE RAW,
+    user_id VARCHAR(64) ENCODE ZSTD,
+    item_id BIGINT ENCODE AZ64,
+    first_view TIMESTAMPTZ ENCODE AZ64,
+    last_view TIMESTAMPTZ ENCODE AZ64,
+    view_count BIGINT ENCODE AZ64
+)
+DISTKEY (user_id)
+COMPOUND SORTKEY (view_date);
+INSERT INTO view_daily_summary_new
+SELECT view_date, RTRIM(user_id), item_id, first_view, last_view, view_count FROM view_daily_summary;
+ALTER TABLE view_daily_summary RENAME TO view_daily_summary_old;
+ALTER TABLE view_daily_summary_new RENAME TO view_daily_summary;
+DROP TABLE view_daily_summary_old;
+GRANT SELECT, INSERT, UPDATE, DELETE ON view_daily_summary TO PUBLIC;
+END TRANSACTION;
+
+ANALYZE view_daily_summary;
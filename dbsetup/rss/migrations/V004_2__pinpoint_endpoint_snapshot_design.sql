@@ -0,0 +1,30 @@
+-- V003__pinpoint_endpoint_snapshot.sql を適用済みの環境のみ実行する。V004__table_design.sql と同じ設計に作り直す
+
+-- Pinpoint のエンドポイントのスナップショット (stage は毎回作り直されるため、作り直すだけでよい)
+BEGIN TRANSACTION;
+CREATE TABLE pinpoint_endpoint_snapshot_new (
+    user_id VARCHAR(64) ENCODE RAW,
+    attr_hash CHAR(32) ENCODE ZSTD
+)
+DISTKEY (user_id)
+SORTKEY (user_id);
+INSERT INTO pinpoint_endpoint_snapshot_new
+SELECT RTRIM(user_id), attr_hash FROM pinpoint_endpoint_snapshot;
+ALTER TABLE pinpoint_endpoint_snapshot RENAME TO pinpoint_endpoint_snapshot_old;
+ALTER TABLE pinpoint_endpoint_snapshot_new RENAME TO pinpoint_endpoint_snapshot;
+DROP TABLE pinpoint_endpoint_snapshot_old;
+GRANT SELECT, INSERT, UPDATE, DELETE ON pinpoint_endpoint_snapshot TO PUBLIC;
+
+DROP TABLE IF EXISTS pinpoint_endpoint_stage;
+CREATE TABLE pinpoint_endpoint_stage (
+    user_id VARCHAR(64) ENCODE RAW,
+    email VARCHAR(256) ENCODE ZSTD,
+    gender VARCHAR(64) ENCODE ZSTD,
+    age INTEGER ENCODE AZ64,
+    interest_name VARCHAR(1024) ENCODE ZSTD,
+    attr_hash CHAR(32) ENCODE ZSTD
+)
+DISTKEY (user_id)
+SORTKEY (user_id);
+GRANT SELECT, INSERT, UPDATE, DELETE ON pinpoint_endpoint_stage TO PUBLIC;
+END TRANSACTION;
@@ -0,0 +1,86 @@
+-- ユーザ ID を VARCHAR に変更し、分散キー・ソートキー・圧縮エンコーディングを設定する
+-- 列の型と分散スタイルを同時に変えるため、ディープコピーでテーブルを作り直す
+-- ソートキーの先頭列は範囲の絞り込みで読むブロックを減らすため RAW とし、それ以外は数値・日時を AZ64、文字列を ZSTD とする
+-- オプションのテーブルは V004_1 (view_daily_summary) / V004_2 (Pinpoint のスナップショット) で移行する
+
+-- ユーザマスタ
+BEGIN TRANSACTION;
+CREATE TABLE user_master_new (
+    user_id VARCHAR(64) NOT NULL ENCODE RAW,
+    email VARCHAR(256) NOT NULL ENCODE ZSTD,
+    gender VARCHAR(64) NOT NULL ENCODE ZSTD,
+    age INTEGER NOT NULL ENCODE AZ64,
+    created_at TIMESTAMP ENCODE AZ64,
+    updated_at TIMESTAMP ENCODE AZ64,
+    PRIMARY KEY (user_id)
+)
+DISTKEY (user_id)
+SORTKEY (user_id);
+INSERT INTO user_master_new
+SELECT RTRIM(user_id), RTRIM(email), gender, age, created_at, updated_at FROM user_master;
+ALTER TABLE user_master RENAME TO user_master_old;
+ALTER TABLE user_master_new RENAME TO user_master;
+DROP TABLE user_master_old;
+GRANT SELECT, INSERT, UPDATE, DELETE ON user_master TO PUBLIC;
+END TRANSACTION;
+
+-- ユーザ興味
+BEGIN TRANSACTION;
+CREATE TABLE user_interest_new (
+    user_id VARCHAR(64) ENCODE RAW,
+    interest_id BIGINT ENCODE AZ64
+)
+DISTKEY (user_id)
+SORTKEY (user_id);
+INSERT INTO user_interest_new
+SELECT RTRIM(user_id), interest_id FROM user_interest;
+ALTER TABLE user_interest RENAME TO user_interest_old;
+ALTER TABLE user_interest_new RENAME TO user_interest;
+DROP TABLE user_interest_old;
+GRANT SELECT, INSERT, UPDATE, DELETE ON user_interest TO PUBLIC;
+END TRANSACTION;
+
+-- 購買履歴
+BEGIN TRANSACTION;
+CREATE TABLE purchase_history_new (
+    user_id VARCHAR(64) ENCODE ZSTD,
+    item_id BIGINT ENCODE AZ64,
+    campaign_id BIGINT ENCODE AZ64,
+    purchase_datetime TIMESTAMPTZ ENCODE RAW
+)
+DISTKEY (user_id)
+COMPOUND SORTKEY (purchase_datetime);
+INSERT INTO purchase_history_new
+SELECT RTRIM(user_id), item_id, campaign_id, purchase_datetime FROM purchase_history;
+ALTER TABLE purchase_history RENAME TO purchase_history_old;
+ALTER TABLE purchase_history_new RENAME TO purchase_history;
+DROP TABLE purchase_history_old;
+GRANT SELECT, INSERT, UPDATE, DELETE ON purchase_history TO PUBLIC;
+END TRANSACTION;
+
+-- 閲覧履歴
+BEGIN TRANSACTION;
+CREATE TABLE view_history_new (
+    user_id VARCHAR(64) ENCODE ZSTD,
+    item_id BIGINT ENCODE AZ64,
+    view_datetime TIMESTAMPTZ ENCODE RAW
+)
+DISTKEY (user_id)
+COMPOUND SORTKEY (view_datetime);
+INSERT INTO view_history_new
+SELECT RTRIM(user_id), item_id, view_datetime FROM view_history ORDER BY view_datetime;
+ALTER TABLE view_history RENAME TO view_history_old;
+ALTER TABLE view_history_new RENAME TO view_history;
+DROP TABLE view_history_old;
+GRANT SELECT, INSERT, UPDATE, DELETE ON view_history TO PUBLIC;
+END TRANSACTION;
+
+-- 件数の少ないマスタは全ノードに複製し、item_id / interest_id での結合でデータを再分散しないようにする
+ALTER TABLE item_master ALTER DISTSTYLE ALL;
+ALTER TABLE interest_master ALTER DISTSTYLE ALL;
+ALTER TABLE campaign ALTER DISTSTYLE ALL;
+
+ANALYZE user_master;
+ANALYZE user_interest;
+ANALYZE purchase_history;
+ANALYZE view_history;
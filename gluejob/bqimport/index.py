@@ -1,9 +1,13 @@
 import sys
+import json
+import math
+import re
 import boto3
 from awsglue.transforms import *
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
 from awsglue.context import GlueContext
+from awsglue.dynamicframe import DynamicFrame
 from awsglue.job import Job
 from datetime import datetime, timedelta, timezone
 
@@ -17,11 +21,28 @@ job.init(args["JOB_NAME"], args)
 
 JST = timezone(timedelta(hours=+9))
 
-test_date = None
-if "--TEST_DATE" in sys.argv:
-    test_date_index = sys.argv.index("--TEST_DATE")
-    if test_date_index + 1 < len(sys.argv):
-        test_date = sys.argv[test_date_index + 1]
+
+def get_optional_arg(name, default=None):
+    if f"--{name}" in sys.argv:
+        index = sys.argv.index(f"--{name}")
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+
+test_date = get_optional_arg("TEST_DATE")
+# 取り込むイベント名 (カンマ区切り)。指定した場合は BigQuery 側で絞り込んでから読み込む
+event_names = [name for name in get_optional_arg("EVENT_NAMES", "").split(",") if name]
+# 取り込む列 (カンマ区切り)。指定しない場合は全列
+columns = [column for column in get_optional_arg("COLUMNS", "").split(",") if column]
+# COLUMNS を指定した場合にクエリ結果を一時テーブルとして保存する BigQuery のデータセット
+materialization_dataset = get_optional_arg("MATERIALIZATION_DATASET", args["DATASET_ID"])
+# 出力形式 (json / json-gzip / parquet)
+output_format = get_optional_arg("OUTPUT_FORMAT", "json")
+# 出力ファイル数。0 の場合は Spark のパーティション数のまま出力する
+output_files = int(get_optional_arg("OUTPUT_FILES", "0"))
+# 1ファイルあたりの目標サイズ (MB)。指定した場合は OUTPUT_FILES より優先し、推定したデータサイズからファイル数を決める
+target_file_size_mb = int(get_optional_arg("TARGET_FILE_SIZE_MB", "0"))
 
 if test_date:
     yesterday = test_date
@@ -41,25 +62,155 @@ def delete_s3_files(bucket, prefix):
     bucket.objects.filter(Prefix=prefix).delete()
 
 
+def get_s3_prefix_size(bucket, prefix):
+    size = 0
+    for page in boto3.client("s3").get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        size += sum(obj["Size"] for obj in page.get("Contents", []))
+    return size
+
+
+def estimate_output_files(df, total_rows, target_bytes, sample_rows=100000):
+    # 先頭の一部の行を出力と同じ形式・圧縮で書き出したときのサイズから全体のサイズを推定する
+    sample = df.limit(sample_rows).persist()
+    sample_count = sample.count()
+    if not sample_count:
+        sample.unpersist()
+        return 1
+    sample_prefix = f"size_samples/{yesterday}/"
+    writer = sample.coalesce(1).write.mode("overwrite")
+    sample_path = f"s3://{bucket_name}/{sample_prefix}"
+    if output_format == "parquet":
+        writer.option("compression", "snappy").parquet(sample_path)
+    elif output_format == "json-gzip":
+        writer.option("compression", "gzip").json(sample_path)
+    else:
+        writer.json(sample_path)
+    sample_bytes = get_s3_prefix_size(bucket_name, sample_prefix)
+    delete_s3_files(bucket_name, sample_prefix)
+    sample.unpersist()
+    print(f"Estimated {sample_bytes / sample_count:.1f} bytes per row from {sample_count} sample rows ({output_format})")
+    return max(1, math.ceil(total_rows * sample_bytes / sample_count / target_bytes))
+
+
+def get_partition_index(key):
+    # Spark の出力ファイル名に含まれるパーティション番号 (part-00000 / part-r-00000)
+    matches = re.findall(r"(?:part|r)-(\d{5})", key.split("/")[-1])
+    return int(matches[-1]) if matches else None
+
+
+def get_file_rows(keys, partition_rows):
+    # パーティションの行数をファイルのキーごとに割り当てる
+    # 1つのパーティションが複数のファイルに書き出された場合は、ファイルごとの行数が分からないため割り当てない
+    partition_keys = {}
+    for key in keys:
+        partition_keys.setdefault(get_partition_index(key), []).append(key)
+    return {
+        partition_keys[index][0]: rows
+        for index, rows in partition_rows.items()
+        if len(partition_keys.get(index, [])) == 1
+    }
+
+
+def write_manifest(bucket, prefix, manifest_key, partition_rows):
+    # データローダーが list_objects_v2 を使わずに対象ファイルを取得できるよう、キー・ETag・行数・サイズを書き出す
+    s3 = boto3.client("s3")
+    files = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Size"] == 0 or obj["Key"].endswith("_$folder$"):
+                continue
+            # データローダーは ETag で前回の実行から変換済みのファイルを判定する
+            files.append({"key": obj["Key"], "bytes": obj["Size"], "etag": obj["ETag"]})
+    # 行数は TARGET_FILE_SIZE_MB 指定時のみ集計しているため、それ以外は出力しない
+    if partition_rows is not None:
+        file_rows = get_file_rows([file["key"] for file in files], partition_rows)
+        for file in files:
+            if file["key"] in file_rows:
+                file["rows"] = file_rows[file["key"]]
+    manifest = {
+        "date": yesterday,
+        "format": output_format,
+        "files": files,
+        "total_bytes": sum(file["bytes"] for file in files),
+    }
+    if partition_rows is not None:
+        manifest["total_rows"] = sum(partition_rows.values())
+    s3.put_object(Bucket=bucket, Key=manifest_key, Body=json.dumps(manifest))
+    print(f"Wrote manifest s3://{bucket}/{manifest_key} ({len(files)} files, {manifest['total_bytes']} bytes)")
+
+
 bucket_name = args["DESTINATION_BUCKET"]
 prefix = f"{yesterday[:4]}/{yesterday[4:6]}/{yesterday[6:8]}/"
+manifest_key = f"manifests/{yesterday[:4]}/{yesterday[4:6]}/{yesterday[6:8]}.json"
 delete_s3_files(bucket_name, prefix)
+boto3.client("s3").delete_object(Bucket=bucket_name, Key=manifest_key)
 
 
 # BigQuery to Glue Dynamic Frame
+bigquery_options = {"connectionName": args["CONNECTION_NAME"], "parentProject": args["PROJECT_ID"], "table": table_name}
+event_filter = "event_name IN ({})".format(", ".join(f"'{name}'" for name in event_names)) if event_names else None
+if columns:
+    # 列の絞り込みを BigQuery 側のクエリで行い、指定した列のみを転送する (結果は materialization_dataset の一時テーブルになる)
+    query = f"SELECT {', '.join(columns)} FROM `{args['PROJECT_ID']}.{table_name}`"
+    if event_filter:
+        query += f" WHERE {event_filter}"
+    bigquery_options = {
+        "connectionName": args["CONNECTION_NAME"],
+        "parentProject": args["PROJECT_ID"],
+        "sourceType": "query",
+        "query": query,
+        "viewsEnabled": "true",
+        "materializationDataset": materialization_dataset,
+    }
+elif event_filter:
+    # Storage Read API の row restriction として BigQuery 側で評価され、対象外のイベントは転送されない
+    bigquery_options["filter"] = event_filter
 GoogleBigQuery_node = glueContext.create_dynamic_frame.from_options(
     connection_type="bigquery",
-    connection_options={"connectionName": args["CONNECTION_NAME"], "parentProject": args["PROJECT_ID"], "table": table_name},
+    connection_options=bigquery_options,
     transformation_ctx="GoogleBigQuery_node",
 )
+partition_rows = None
+repartitioned_df = None
+if target_file_size_mb > 0:
+    # 件数の集計と書き出しで BigQuery から2回読まないようにキャッシュする
+    source_df = GoogleBigQuery_node.toDF().persist()
+    total_rows = source_df.count()
+    num_files = estimate_output_files(source_df, total_rows, target_file_size_mb * 1024 * 1024)
+    print(f"Repartitioning {total_rows} rows into {num_files} files")
+    # repartition で行を均等に分散し、サイズの偏ったファイルを作らないようにする
+    repartitioned_df = source_df.repartition(num_files).persist()
+    partition_rows = dict(
+        repartitioned_df.rdd.mapPartitionsWithIndex(lambda index, rows: [(index, sum(1 for _ in rows))]).collect()
+    )
+    # repartition 後の結果がキャッシュされたため、読み込んだ結果のキャッシュは解放する
+    source_df.unpersist()
+    GoogleBigQuery_node = DynamicFrame.fromDF(repartitioned_df, glueContext, "Repartition_node")
+elif output_files > 0:
+    GoogleBigQuery_node = GoogleBigQuery_node.coalesce(output_files)
 
 # Glue Dynamic Frame to S3
+s3_options = {"path": s3_destination, "partitionKeys": []}
+if output_format == "parquet":
+    write_format, format_options = "glueparquet", {"compression": "snappy"}
+elif output_format == "json-gzip":
+    write_format, format_options = "json", {}
+    s3_options["compression"] = "gzip"
+else:
+    write_format, format_options = "json", {}
+
 AmazonS3_node = glueContext.write_dynamic_frame.from_options(
     frame=GoogleBigQuery_node,
     connection_type="s3",
-    format="json",
-    connection_options={"path": s3_destination, "partitionKeys": []},
+    format=write_format,
+    format_options=format_options,
+    connection_options=s3_options,
     transformation_ctx="AmazonS3_node",
 )
 
+if repartitioned_df is not None:
+    repartitioned_df.unpersist()
+
+write_manifest(bucket_name, prefix, manifest_key, partition_rows)
+
 job.commit()
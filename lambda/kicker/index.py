@@ -2,22 +2,51 @@ import boto3
 import os
 import json
 from datetime import datetime, timedelta, timezone
+from metrics import Metrics
 
 
 JST = timezone(timedelta(hours=+9), "JST")
 STATEMACHINE_ARN = os.environ["STATEMACHINE_ARN"]
+BACKFILL_STATEMACHINE_ARN = os.environ["BACKFILL_STATEMACHINE_ARN"]
+# 1回のバックフィルで取り込める最大日数
+BACKFILL_MAX_DAYS = int(os.environ.get("BACKFILL_MAX_DAYS", "31"))
 stepfunctions = boto3.client("stepfunctions")
+metrics = Metrics("kicker")
 
 
 def process(target_date):
     stepfunctions.start_execution(stateMachineArn=STATEMACHINE_ARN, input=json.dumps({"targetDate": target_date}))
 
 
+def backfill(start_date, end_date):
+    start = datetime.strptime(start_date, "%Y%m%d").date()
+    end = datetime.strptime(end_date, "%Y%m%d").date()
+    days = (end - start).days + 1
+    if days < 1:
+        raise ValueError(f"endDate {end_date} is before startDate {start_date}")
+    if days > BACKFILL_MAX_DAYS:
+        raise ValueError(f"Backfill of {days} days exceeds the limit of {BACKFILL_MAX_DAYS} days")
+
+    # 日ごとの GA の取り込みは同時実行数を制限して並列に、データのロードと学習は期間全体で1回だけ実行する
+    target_dates = [(start + timedelta(days=i)).strftime("%Y%m%d") for i in range(days)]
+    stepfunctions.start_execution(
+        stateMachineArn=BACKFILL_STATEMACHINE_ARN,
+        input=json.dumps({"startDate": start_date, "endDate": end_date, "targetDates": target_dates}),
+    )
+
+
 def handler(event, context):
+    # startDate が指定された場合は endDate (省略時は startDate) までの期間をバックフィルする
+    if event.get("startDate"):
+        with metrics.span("start_execution", Mode="backfill", StartDate=event["startDate"]):
+            backfill(event["startDate"], event.get("endDate") or event["startDate"])
+        return
+
     # eventで指定された場合はその日付、されなかった場合には前日の日付を対象とする
     target_date = event.get("targetDate")
     if not target_date:
         tomorrow = datetime.now(JST).date() - timedelta(days=1)
         target_date = tomorrow.strftime("%Y%m%d")
 
-    process(target_date)
+    with metrics.span("start_execution", Mode="daily", TargetDate=target_date):
+        process(target_date)
@@ -87,7 +87,8 @@ export class DataLoader extends Construct {
     );
 
     const asset = new DockerImageAsset(this, 'DockerImage', {
-      directory: path.join(__dirname, '..', 'dataloader'),
+      directory: path.join(__dirname, '..'),
+      file: 'dataloader/Dockerfile',
       platform: Platform.LINUX_AMD64
     });
     const containerName = `${cdk.Stack.of(this).stackName}-loader-container`;
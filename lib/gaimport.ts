@@ -15,6 +15,8 @@ export class GAImport extends Construct {
   readonly glueJob: glue.Job;
   readonly bucket: s3.Bucket;
   readonly glueJobArgs: any;
+  // バックフィル時に並列実行できる Glue ジョブの数
+  readonly maxConcurrentRuns: number = 4;
   constructor(scope: Construct, id: string, props: GAImportProps) {
     super(scope, id);
 
@@ -69,6 +71,7 @@ export class GAImport extends Construct {
       defaultArguments: this.glueJobArgs,
       connections: [bigQueryConnection],
       maxRetries: 0,
+      maxConcurrentRuns: this.maxConcurrentRuns,
       timeout: cdk.Duration.days(1),
       workerType: glue.WorkerType.STANDARD,
       workerCount: 1
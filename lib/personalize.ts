@@ -196,7 +196,8 @@ export class Personalize extends Construct {
     );
 
     const asset = new DockerImageAsset(this, 'DockerImage', {
-      directory: path.join(__dirname, '..', 'personalize'),
+      directory: path.join(__dirname, '..'),
+      file: 'personalize/Dockerfile',
       platform: Platform.LINUX_AMD64
     });
     const containerName = `${cdk.Stack.of(this).stackName}-personalize-training`;
@@ -18,6 +18,7 @@ interface PinpointProps {
 export class Pinpoint extends Construct {
   cluster: ecs.Cluster;
   taskDefinition: ecs.TaskDefinition;
+  containerDefinition: ecs.ContainerDefinition;
   securityGroup: ec2.SecurityGroup;
   constructor(scope: Construct, id: string, props: PinpointProps) {
     super(scope, id);
@@ -105,11 +106,12 @@ export class Pinpoint extends Construct {
     bucket.grantReadWrite(props.redshift.rsRole);
 
     const asset = new DockerImageAsset(this, 'DockerImage', {
-      directory: path.join(__dirname, '..', 'pinpoint'),
+      directory: path.join(__dirname, '..'),
+      file: 'pinpoint/Dockerfile',
       platform: Platform.LINUX_AMD64
     });
     const containerName = `${cdk.Stack.of(this).stackName}-pinpoint-createsegment`;
-    this.taskDefinition.addContainer('Container', {
+    this.containerDefinition = this.taskDefinition.addContainer('Container', {
       containerName: containerName,
       image: ecs.AssetImage.fromDockerImageAsset(asset),
       logging: ecs.LogDriver.awsLogs({
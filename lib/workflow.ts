@@ -5,7 +5,7 @@ import * as ec2 from 'aws-cdk-lib/aws-ec2';
 import * as sfn from 'aws-cdk-lib/aws-stepfunctions';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as sfntasks from 'aws-cdk-lib/aws-stepfunctions-tasks';
-import { PythonFunction } from '@aws-cdk/aws-lambda-python-alpha';
+import { PythonFunction, PythonLayerVersion } from '@aws-cdk/aws-lambda-python-alpha';
 
 import * as ecs from 'aws-cdk-lib/aws-ecs';
 import { Personalize } from './personalize';
@@ -34,79 +34,162 @@ export class Workflow extends Construct {
   constructor(scope: Construct, id: string, props: WorkflowProps) {
     super(scope, id);
 
-    const start = new sfntasks.GlueStartJobRun(this, 'GlueJob', {
-      glueJobName: props.gaimport.glueJob.jobName,
-      integrationPattern: sfn.IntegrationPattern.RUN_JOB,
-      arguments: sfn.TaskInput.fromObject({
-        ...props.gaimport.glueJobArgs,
-        ...{ '--TEST_DATE': sfn.JsonPath.stringAt('$.targetDate') }
-      }),
-      resultPath: '$.glueJobResult'
-    })
-      .next(
-        new sfntasks.EcsRunTask(this, 'DataLoader', {
-          integrationPattern: sfn.IntegrationPattern.RUN_JOB,
-          cluster: props.dataloader.cluster,
-          taskDefinition: props.dataloader.taskDefinition,
-          launchTarget: new sfntasks.EcsFargateLaunchTarget({ platformVersion: ecs.FargatePlatformVersion.LATEST }),
-          securityGroups: [props.dataloader.securityGroup],
-          resultPath: '$.dataloaderResult',
-          containerOverrides: [
-            {
-              containerDefinition: props.dataloader.containerDefinition,
-              environment: [
-                {
-                  name: 'TEST_DATE',
-                  value: sfn.JsonPath.stringAt('$.targetDate')
-                }
-              ]
-            }
-          ]
-        })
-      )
+    const start = this.glueJobTask('GlueJob', props, '$.targetDate', '$.glueJobResult')
+      .next(this.dataLoaderTask('DataLoader', props, [{ name: 'TEST_DATE', value: sfn.JsonPath.stringAt('$.targetDate') }]))
+      .next(this.trainingAndSegmentCreation('', props, '$.targetDate', []));
+
+    const smachine = new sfn.StateMachine(this, 'StateMachine', {
+      definitionBody: sfn.DefinitionBody.fromChainable(start)
+    });
+
+    // バックフィル: 日ごとの GA の取り込みを同時実行数を制限して並列に行い、ロードと学習は期間全体で1回だけ実行する
+    const backfillGlueJobs = new sfn.Map(this, 'BackfillGlueJobs', {
+      itemsPath: sfn.JsonPath.stringAt('$.targetDates'),
+      itemSelector: { targetDate: sfn.JsonPath.stringAt('$$.Map.Item.Value') },
+      maxConcurrency: props.gaimport.maxConcurrentRuns,
+      resultPath: sfn.JsonPath.DISCARD
+    }).itemProcessor(this.glueJobTask('BackfillGlueJob', props, '$.targetDate', sfn.JsonPath.DISCARD));
+    const backfillStart = backfillGlueJobs
       .next(
-        new sfntasks.EcsRunTask(this, 'PersonalizeTraining', {
-          integrationPattern: sfn.IntegrationPattern.RUN_JOB,
-          cluster: props.personalize.cluster,
-          taskDefinition: props.personalize.taskDefinition,
-          launchTarget: new sfntasks.EcsFargateLaunchTarget({ platformVersion: ecs.FargatePlatformVersion.LATEST }),
-          securityGroups: [props.personalize.securityGroup],
-          resultPath: '$.personalizeResult',
-          containerOverrides: [
-            {
-              containerDefinition: props.personalize.containerDefinition,
-              environment: [
-                {
-                  name: 'TEST_DATE',
-                  value: sfn.JsonPath.stringAt('$.targetDate')
-                }
-              ]
-            }
-          ]
-        })
+        this.dataLoaderTask('BackfillDataLoader', props, [
+          { name: 'TEST_DATE', value: sfn.JsonPath.stringAt('$.startDate') },
+          { name: 'TEST_END_DATE', value: sfn.JsonPath.stringAt('$.endDate') }
+        ])
       )
       .next(
-        new sfntasks.EcsRunTask(this, 'PinpointSegmentCreation', {
-          integrationPattern: sfn.IntegrationPattern.RUN_JOB,
-          cluster: props.pinpoint.cluster,
-          taskDefinition: props.pinpoint.taskDefinition,
-          launchTarget: new sfntasks.EcsFargateLaunchTarget({ platformVersion: ecs.FargatePlatformVersion.LATEST }),
-          securityGroups: [props.pinpoint.securityGroup],
-          resultPath: '$.pinpointResult'
-        })
+        this.trainingAndSegmentCreation('Backfill', props, '$.endDate', [
+          // 期間全体を取り込むため、INCREMENTAL の設定でも FULL でインポートする
+          { name: 'PERSONALIZE_FORCE_FULL_IMPORT', value: 'true' }
+        ])
       );
 
-    const smachine = new sfn.StateMachine(this, 'StateMachine', {
-      definitionBody: sfn.DefinitionBody.fromChainable(start)
+    const backfillSmachine = new sfn.StateMachine(this, 'BackfillStateMachine', {
+      definitionBody: sfn.DefinitionBody.fromChainable(backfillStart)
+    });
+
+    // コンテナと共通のモジュール (common/) を Lambda から import できるようにする
+    const commonLayer = new PythonLayerVersion(this, 'CommonLayer', {
+      entry: 'common',
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_12]
     });
+
     const kicker = new PythonFunction(this, 'Kicker', {
       entry: 'lambda/kicker',
       runtime: lambda.Runtime.PYTHON_3_12,
       timeout: cdk.Duration.seconds(60),
+      layers: [commonLayer],
       environment: {
-        STATEMACHINE_ARN: smachine.stateMachineArn
+        STATEMACHINE_ARN: smachine.stateMachineArn,
+        BACKFILL_STATEMACHINE_ARN: backfillSmachine.stateMachineArn
       }
     });
     smachine.grantStartExecution(kicker);
+    backfillSmachine.grantStartExecution(kicker);
+  }
+
+  glueJobTask(id: string, props: WorkflowProps, targetDatePath: string, resultPath: string) {
+    return new sfntasks.GlueStartJobRun(this, id, {
+      glueJobName: props.gaimport.glueJob.jobName,
+      integrationPattern: sfn.IntegrationPattern.RUN_JOB,
+      arguments: sfn.TaskInput.fromObject({
+        ...props.gaimport.glueJobArgs,
+        ...{ '--TEST_DATE': sfn.JsonPath.stringAt(targetDatePath) }
+      }),
+      resultPath: resultPath
+    });
+  }
+
+  dataLoaderTask(id: string, props: WorkflowProps, environment: sfntasks.TaskEnvironmentVariable[]) {
+    return new sfntasks.EcsRunTask(this, id, {
+      integrationPattern: sfn.IntegrationPattern.RUN_JOB,
+      cluster: props.dataloader.cluster,
+      taskDefinition: props.dataloader.taskDefinition,
+      launchTarget: new sfntasks.EcsFargateLaunchTarget({ platformVersion: ecs.FargatePlatformVersion.LATEST }),
+      securityGroups: [props.dataloader.securityGroup],
+      resultPath: '$.dataloaderResult',
+      containerOverrides: [
+        {
+          containerDefinition: props.dataloader.containerDefinition,
+          environment: environment
+        }
+      ]
+    });
+  }
+
+  personalizeTask(id: string, props: WorkflowProps, environment: sfntasks.TaskEnvironmentVariable[]) {
+    return new sfntasks.EcsRunTask(this, id, {
+      integrationPattern: sfn.IntegrationPattern.RUN_JOB,
+      cluster: props.personalize.cluster,
+      taskDefinition: props.personalize.taskDefinition,
+      launchTarget: new sfntasks.EcsFargateLaunchTarget({ platformVersion: ecs.FargatePlatformVersion.LATEST }),
+      securityGroups: [props.personalize.securityGroup],
+      resultPath: '$.personalizeResult',
+      containerOverrides: [
+        {
+          containerDefinition: props.personalize.containerDefinition,
+          environment: environment
+        }
+      ]
+    });
+  }
+
+  pinpointTask(id: string, props: WorkflowProps, environment: sfntasks.TaskEnvironmentVariable[]) {
+    return new sfntasks.EcsRunTask(this, id, {
+      integrationPattern: sfn.IntegrationPattern.RUN_JOB,
+      cluster: props.pinpoint.cluster,
+      taskDefinition: props.pinpoint.taskDefinition,
+      launchTarget: new sfntasks.EcsFargateLaunchTarget({ platformVersion: ecs.FargatePlatformVersion.LATEST }),
+      securityGroups: [props.pinpoint.securityGroup],
+      resultPath: '$.pinpointResult',
+      containerOverrides: [
+        {
+          containerDefinition: props.pinpoint.containerDefinition,
+          environment: environment
+        }
+      ]
+    });
+  }
+
+  // Pinpoint のセグメント作成は Personalize の学習結果を使わないため、2つを並列のブランチとして実行する
+  // 失敗はブランチ内で catch して他方のブランチを止めずに最後まで実行させてから、ワークフロー全体を失敗にする
+  // Personalize はインポート済みの Interaction を再度インポートしてしまうため、コンテナ単位ではリトライしない
+  trainingAndSegmentCreation(
+    prefix: string,
+    props: WorkflowProps,
+    targetDatePath: string,
+    personalizeEnvironment: sfntasks.TaskEnvironmentVariable[]
+  ) {
+    const targetDate = { name: 'TEST_DATE', value: sfn.JsonPath.stringAt(targetDatePath) };
+
+    const personalizeBranch = this.personalizeTask(`${prefix}PersonalizeTraining`, props, [
+      targetDate,
+      ...personalizeEnvironment
+    ]).addCatch(new sfn.Pass(this, `${prefix}PersonalizeTrainingFailed`), { resultPath: '$.personalizeError' });
+    const pinpointBranch = this.pinpointTask(`${prefix}PinpointSegmentCreation`, props, [targetDate])
+      .addRetry({ errors: ['States.TaskFailed'], interval: cdk.Duration.minutes(1), maxAttempts: 2, backoffRate: 2 })
+      .addCatch(new sfn.Pass(this, `${prefix}PinpointSegmentCreationFailed`), { resultPath: '$.pinpointError' });
+
+    const parallel = new sfn.Parallel(this, `${prefix}TrainingAndSegmentCreation`, { resultPath: '$.branchResults' })
+      .branch(personalizeBranch)
+      .branch(pinpointBranch);
+
+    return parallel.next(
+      new sfn.Choice(this, `${prefix}CheckBranchResults`)
+        .when(
+          sfn.Condition.isPresent('$.branchResults[0].personalizeError'),
+          new sfn.Fail(this, `${prefix}PersonalizeTrainingError`, {
+            error: 'PersonalizeTrainingFailed',
+            causePath: sfn.JsonPath.stringAt('$.branchResults[0].personalizeError.Cause')
+          })
+        )
+        .when(
+          sfn.Condition.isPresent('$.branchResults[1].pinpointError'),
+          new sfn.Fail(this, `${prefix}PinpointSegmentCreationError`, {
+            error: 'PinpointSegmentCreationFailed',
+            causePath: sfn.JsonPath.stringAt('$.branchResults[1].pinpointError.Cause')
+          })
+        )
+        .otherwise(new sfn.Succeed(this, `${prefix}Completed`))
+    );
   }
 }
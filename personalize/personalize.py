@@ -1,8 +1,12 @@
 import os
 import boto3
 import uuid
-import time
 from datetime import datetime, timezone, timedelta
+from functools import partial
+from job_tracker import JobTracker
+from metrics import Metrics
+from redshift_data import RedshiftStatementExecutor
+from s3_objects import delete_prefix
 
 JST = timezone(timedelta(hours=+9))
 TEST_DATE = os.environ.get("TEST_DATE", "")
@@ -17,104 +21,184 @@ PERSONALIZE_ITEM_DATASET = os.environ["PERSONALIZE_ITEM_DATASET"]
 PERSONALIZE_USER_DATASET = os.environ["PERSONALIZE_USER_DATASET"]
 PERSONALIZE_INTERACTION_DATASET = os.environ["PERSONALIZE_INTERACTION_DATASET"]
 PERSONALIZE_RECOMMENDER_NAME = os.environ["PERSONALIZE_RECOMMENDER_NAME"]
+# INCREMENTAL の場合は対象日の差分のみをインポートし、PERSONALIZE_FULL_IMPORT_WEEKDAY の曜日(0:月曜〜6:日曜)は FULL でインポートする
+PERSONALIZE_IMPORT_MODE = os.environ.get("PERSONALIZE_IMPORT_MODE", "FULL").upper()
+PERSONALIZE_FULL_IMPORT_WEEKDAY = int(os.environ.get("PERSONALIZE_FULL_IMPORT_WEEKDAY", "6"))
+PERSONALIZE_FORCE_FULL_IMPORT = os.environ.get("PERSONALIZE_FORCE_FULL_IMPORT", "false").lower() == "true"
+# ユーザ・アイテムの抽出に view_history の日次集計テーブル(view_daily_summary)を利用する
+PERSONALIZE_USE_VIEW_SUMMARY = os.environ.get("PERSONALIZE_USE_VIEW_SUMMARY", "false").lower() == "true"
 PERSONALIZE_RECIPE = os.environ.get("PERSONALIZE_RECIPE", "arn:aws:personalize:::recipe/aws-ecomm-customers-who-viewed-x-also-viewed")
 
+metrics = Metrics("personalize")
 rss = boto3.client("redshift-data", region_name=REGION)
+rs_executor = RedshiftStatementExecutor(rss, REDSHIFT_DATABASENAME, REDSHIFT_WORKGROUP, metrics=metrics)
 s3 = boto3.client("s3", region_name=REGION)
 personalize = boto3.client("personalize", region_name=REGION)
 
 
-def execute_redshift_query(query):
-    response = rss.execute_statement(Database=REDSHIFT_DATABASENAME, WorkgroupName=REDSHIFT_WORKGROUP, Sql=query)
-    query_id = response["Id"]
+def makesure_empty(target_date):
+    delete_prefix(s3, BUCKET_NAME, target_date.strftime("%Y/%m/%d"))
 
-    while True:
-        status_response = rss.describe_statement(Id=query_id)
-        if status_response["Status"] == "FINISHED":
-            break
-        elif status_response["Status"] == "FAILED":
-            raise Exception(f"Query failed: {status_response['Error']}")
-        time.sleep(5)
 
+def get_import_mode(target_date):
+    if PERSONALIZE_IMPORT_MODE != "INCREMENTAL" or PERSONALIZE_FORCE_FULL_IMPORT:
+        return "FULL"
+    if target_date.weekday() == PERSONALIZE_FULL_IMPORT_WEEKDAY:
+        return "FULL"
+    return "INCREMENTAL"
+
+
+def get_date_ranges(dates):
+    # 日付のリストを連続した日ごとの (開始日, 終了日) にまとめる
+    ranges = []
+    for d in sorted(dates):
+        if ranges and ranges[-1][1] + timedelta(days=1) == d:
+            ranges[-1][1] = d
+        else:
+            ranges.append([d, d])
+    return ranges
 
-def makesure_empty(target_date):
-    s3pathprefix = target_date.strftime("%Y/%m/%d")
-    paginator = s3.get_paginator("list_objects_v2")
-    pages = paginator.paginate(Bucket=BUCKET_NAME, Prefix=s3pathprefix)
 
-    delete_list = []
-    for page in pages:
-        if "Contents" in page:
-            for obj in page["Contents"]:
-                delete_list.append({"Key": obj["Key"]})
+def refresh_view_daily_summary(target_date):
+    # view_history を日・ユーザ・アイテム単位で集計したテーブルを、未集計の日と対象日のみ更新する
+    # 閲覧が0件の日も集計済みとして扱えるよう、集計した日は view_daily_summary_dates に記録する
+    one_month_ago = target_date - timedelta(days=31)
+    result = rs_executor.execute(
+        f"SELECT view_date FROM view_daily_summary_dates WHERE view_date >= '{one_month_ago}' AND view_date <= '{target_date}'",
+        "view_daily_summary days",
+    )
+    summarized_dates = {record[0] for record in rs_executor.fetch_records(result["Id"])}
+    window_dates = [one_month_ago + timedelta(days=i) for i in range((target_date - one_month_ago).days + 1)]
+    # 対象日は dataloader で再取り込みされている可能性があるため常に集計し直す
+    refresh_dates = [d for d in window_dates if d == target_date or d.isoformat() not in summarized_dates]
+    refresh_ranges = get_date_ranges(refresh_dates)
+    print(f"Refreshing view_daily_summary for {', '.join(f'{start}..{end}' for start, end in refresh_ranges)}")
 
-    if delete_list:
-        s3.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": delete_list})
+    sqls = [
+        f"DELETE FROM view_daily_summary WHERE view_date < '{one_month_ago}'",
+        f"DELETE FROM view_daily_summary_dates WHERE view_date < '{one_month_ago}'",
+    ]
+    for start_date, end_date in refresh_ranges:
+        sqls += [
+            f"DELETE FROM view_daily_summary WHERE view_date >= '{start_date}' AND view_date <= '{end_date}'",
+            f"""INSERT INTO view_daily_summary (view_date, user_id, item_id, first_view, last_view, view_count)
+            SELECT TRUNC(view_datetime), user_id, item_id, MIN(view_datetime), MAX(view_datetime), COUNT(*)
+            FROM view_history
+            WHERE view_datetime >= '{start_date}' AND view_datetime < '{end_date + timedelta(days=1)}'
+            GROUP BY TRUNC(view_datetime), user_id, item_id""",
+            f"DELETE FROM view_daily_summary_dates WHERE view_date >= '{start_date}' AND view_date <= '{end_date}'",
+        ]
+    values = ", ".join(f"('{d}')" for d in refresh_dates)
+    sqls.append(f"INSERT INTO view_daily_summary_dates (view_date) VALUES {values}")
+    rs_executor.execute_batch(sqls, "view_daily_summary")
 
-    print(f"Deleted {len(delete_list)} objects from {BUCKET_NAME}/{s3pathprefix}")
 
+def get_dataset_selects(target_date, import_mode):
+    one_month_ago = target_date - timedelta(days=31)
+    next_date = target_date + timedelta(days=1)
+
+    if import_mode == "INCREMENTAL":
+        interaction_select = f"""SELECT user_id, item_id, EXTRACT(EPOCH FROM view_datetime)::bigint as timestamp, ''View'' as event_type FROM view_history
+             WHERE view_datetime >= ''{target_date}'' AND view_datetime < ''{next_date}''"""
+    else:
+        interaction_select = f"""SELECT user_id, item_id, EXTRACT(EPOCH FROM view_datetime)::bigint as timestamp, ''View'' as event_type FROM view_history 
+             WHERE view_datetime >= ''{one_month_ago}'' AND view_datetime < ''{next_date}''"""
 
-def prepare_dataset(target_date):
+    if PERSONALIZE_USE_VIEW_SUMMARY:
+        # ユーザ・アイテムは集計済みテーブルから抽出し、view_history の走査を interaction の1回のみにする
+        user_activity = f"""SELECT user_id, MIN(view_date) AS first_view FROM view_daily_summary
+                   WHERE view_date >= ''{one_month_ago}'' AND view_date <= ''{target_date}'' GROUP BY user_id"""
+        item_activity = f"""SELECT item_id, MIN(view_date) AS first_view FROM view_daily_summary
+                   WHERE view_date >= ''{one_month_ago}'' AND view_date <= ''{target_date}'' GROUP BY item_id"""
+    else:
+        user_activity = f"""SELECT user_id, MIN(view_datetime) AS first_view FROM view_history
+                   WHERE view_datetime >= ''{one_month_ago}'' AND view_datetime < ''{next_date}'' GROUP BY user_id"""
+        item_activity = f"""SELECT item_id, MIN(view_datetime) AS first_view FROM view_history
+                   WHERE view_datetime >= ''{one_month_ago}'' AND view_datetime < ''{next_date}'' GROUP BY item_id"""
+
+    if import_mode == "INCREMENTAL":
+        # 対象日に初めて閲覧された(または属性が更新された)ユーザ・アイテムのみ
+        user_filter = f"WHERE vh.first_view >= ''{target_date}'' OR um.updated_at >= ''{target_date}''"
+        item_filter = f"WHERE vh.first_view >= ''{target_date}''"
+    else:
+        # 過去一ヶ月に閲覧のあった全ユーザ・全アイテム
+        user_filter = ""
+        item_filter = ""
+
+    user_select = f"""SELECT um.user_id, um.gender, um.age FROM user_master um
+             JOIN ({user_activity}) vh
+             ON um.user_id = vh.user_id
+             {user_filter}"""
+    item_select = f"""SELECT im.item_id, im.item_category_id AS CATEGORY_L1, im.price FROM item_master im
+             JOIN ({item_activity}) vh
+             ON im.item_id = vh.item_id
+             {item_filter}"""
+    return [("interactions", interaction_select), ("users", user_select), ("items", item_select)]
+
+
+def prepare_dataset(target_date, import_mode="FULL"):
     makesure_empty(target_date)
 
+    if PERSONALIZE_USE_VIEW_SUMMARY:
+        refresh_view_daily_summary(target_date)
+
     # 過去一ヶ月分のデータで学習
-    one_month_ago = target_date - timedelta(days=31)
     date_str = target_date.strftime("%Y/%m/%d")
-
-    # Interaction data
-    interaction_query = f"""
-    UNLOAD ('SELECT user_id, item_id, EXTRACT(EPOCH FROM view_datetime)::bigint as timestamp, ''View'' as event_type FROM view_history 
-             WHERE view_datetime >= ''{one_month_ago}'' AND view_datetime < ''{target_date + timedelta(days=1)}''')
-    TO 's3://{BUCKET_NAME}/{date_str}/interactions/'
+    statements = []
+    for name, select in get_dataset_selects(target_date, import_mode):
+        query = f"""
+    UNLOAD ('{select}')
+    TO 's3://{BUCKET_NAME}/{date_str}/{name}/'
     IAM_ROLE '{REDSHIFT_ROLE_ARN}'
     CSV HEADER;
     """
-    execute_redshift_query(interaction_query)
-
-    # User data (all users involved in the last month)
-    user_query = f"""
-    UNLOAD ('SELECT DISTINCT um.user_id, um.gender, um.age FROM user_master um
-             JOIN view_history vh ON um.user_id = vh.user_id
-             WHERE vh.view_datetime >= ''{one_month_ago}'' AND vh.view_datetime < ''{target_date + timedelta(days=1)}''')
-    TO 's3://{BUCKET_NAME}/{date_str}/users/'
-    IAM_ROLE '{REDSHIFT_ROLE_ARN}'
-    CSV HEADER;
-    """
-    execute_redshift_query(user_query)
-
-    # Item data (all items viewed in the last month)
-    item_query = f"""
-    UNLOAD ('SELECT DISTINCT im.item_id, im.item_category_id AS CATEGORY_L1, im.price FROM item_master im
-             JOIN view_history vh ON im.item_id = vh.item_id
-             WHERE vh.view_datetime >= ''{one_month_ago}'' AND vh.view_datetime < ''{target_date + timedelta(days=1)}''')
-    TO 's3://{BUCKET_NAME}/{date_str}/items/'
-    IAM_ROLE '{REDSHIFT_ROLE_ARN}'
-    CSV HEADER;
-    """
-    execute_redshift_query(item_query)
+        statements.append(rs_executor.submit(query, name))
+
+    # 3つの UNLOAD は独立しているため、まとめて完了を待つ
+    with metrics.span("unload") as span:
+        rs_executor.wait(statements)
+        span.add("BytesOut", get_prefix_size(date_str), "Bytes")
+
+
+def get_prefix_size(s3_prefix):
+    size = 0
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME, Prefix=s3_prefix):
+        size += sum(obj["Size"] for obj in page.get("Contents", []))
+    return size
 
 
-def update_personalize_dataset(dataset_arn, s3_path):
-    # Create a new import job
+def has_data_rows(s3_prefix):
+    # UNLOAD の出力がヘッダ行のみの場合はインポートしない
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=s3_prefix):
+        for obj in page.get("Contents", []):
+            if obj["Size"] == 0:
+                continue
+            head = s3.get_object(Bucket=BUCKET_NAME, Key=obj["Key"], Range="bytes=0-65535")["Body"].read()
+            if len(head.splitlines()) > 1:
+                return True
+    return False
+
+
+def start_dataset_import_job(dataset_arn, s3_path, import_mode="FULL"):
     import_job_response = personalize.create_dataset_import_job(
         jobName=f"Job-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4()}",
         datasetArn=dataset_arn,
         dataSource={"dataLocation": s3_path},
         roleArn=PERSONALIZE_ROLE_ARN,
-        importMode="FULL",
+        importMode=import_mode,
     )
+    return import_job_response["datasetImportJobArn"]
+
+
+def describe_dataset_import_job(import_job_arn):
+    import_job = personalize.describe_dataset_import_job(datasetImportJobArn=import_job_arn)["datasetImportJob"]
+    return import_job["status"], None
 
-    import_job_arn = import_job_response["datasetImportJobArn"]
 
-    # Wait for the import job to complete
-    while True:
-        import_job = personalize.describe_dataset_import_job(datasetImportJobArn=import_job_arn)
-        status = import_job["datasetImportJob"]["status"]
-        if status == "ACTIVE":
-            break
-        elif status == "CREATE FAILED":
-            raise Exception("Dataset import job failed")
-        time.sleep(60)
+def describe_recommender(recommender_arn):
+    recommender = personalize.describe_recommender(recommenderArn=recommender_arn)["recommender"]
+    return recommender["status"], None
 
 
 def create_recommender():
@@ -126,34 +210,47 @@ def create_recommender():
         )
         recommender_arn = response["recommenderArn"]
 
-        while True:
-            recommender = personalize.describe_recommender(recommenderArn=recommender_arn)
-            status = recommender["recommender"]["status"]
-            if status == "ACTIVE":
-                break
-            elif "FAIL" in status:
-                raise Exception("Recommender creation failed")
-            time.sleep(60)
+        tracker = JobTracker(min_interval=30, max_interval=300, metrics=metrics)
+        tracker.add("recommender", partial(describe_recommender, recommender_arn), ["ACTIVE"], ["CREATE FAILED"])
+        tracker.wait_all()
 
 
 if __name__ == "__main__":
-    if TEST_DATE:
-        target_date = datetime.strptime(TEST_DATE, "%Y%m%d").replace(tzinfo=JST).date()
-    else:
-        target_date = (datetime.now(JST) - timedelta(days=1)).date()
+    with metrics.profile(), metrics.span("total"):
+        if TEST_DATE:
+            target_date = datetime.strptime(TEST_DATE, "%Y%m%d").replace(tzinfo=JST).date()
+        else:
+            target_date = (datetime.now(JST) - timedelta(days=1)).date()
 
-    print(f"Processing data for date: {target_date}")
+        print(f"Processing data for date: {target_date}")
 
-    prepare_dataset(target_date)
+        import_mode = get_import_mode(target_date)
+        print(f"Import mode: {import_mode}")
 
-    date_str = target_date.strftime("%Y/%m/%d")
-    print("Importing interaction dataset...")
-    update_personalize_dataset(PERSONALIZE_INTERACTION_DATASET, f"s3://{BUCKET_NAME}/{date_str}/interactions/")
-    print("Importing user dataset...")
-    update_personalize_dataset(PERSONALIZE_USER_DATASET, f"s3://{BUCKET_NAME}/{date_str}/users/")
-    print("Importing item dataset...")
-    update_personalize_dataset(PERSONALIZE_ITEM_DATASET, f"s3://{BUCKET_NAME}/{date_str}/items/")
+        with metrics.span("prepare_dataset", ImportMode=import_mode):
+            prepare_dataset(target_date, import_mode)
+
+        date_str = target_date.strftime("%Y/%m/%d")
+        datasets = [
+            ("interaction", PERSONALIZE_INTERACTION_DATASET, f"{date_str}/interactions/"),
+            ("user", PERSONALIZE_USER_DATASET, f"{date_str}/users/"),
+            ("item", PERSONALIZE_ITEM_DATASET, f"{date_str}/items/"),
+        ]
+        # 3つのインポートジョブを同時に投入し、まとめて完了を待つ
+        with metrics.span("dataset_import", ImportMode=import_mode) as span:
+            tracker = JobTracker(min_interval=15, max_interval=120, metrics=metrics)
+            for name, dataset_arn, s3_prefix in datasets:
+                if import_mode == "INCREMENTAL" and not has_data_rows(s3_prefix):
+                    print(f"No new {name} data. Skipping import.")
+                    continue
+                print(f"Importing {name} dataset...")
+                import_job_arn = start_dataset_import_job(dataset_arn, f"s3://{BUCKET_NAME}/{s3_prefix}", import_mode)
+                tracker.add(f"{name} import", partial(describe_dataset_import_job, import_job_arn), ["ACTIVE"], ["CREATE FAILED"])
+            span.add("Jobs", len(tracker.jobs))
+            tracker.wait_all()
+
+        with metrics.span("recommender"):
+            create_recommender()
 
-    create_recommender()
+        print("Completed")
 
-    print("Completed")
@@ -1,10 +1,15 @@
 import os
 import boto3
 import uuid
-import time
 from datetime import datetime, timezone, timedelta
+from functools import partial
+from job_tracker import JobTracker
+from metrics import Metrics
+from redshift_data import RedshiftStatementExecutor
+from s3_objects import delete_prefix
 
 JST = timezone(timedelta(hours=+9))
+TEST_DATE = os.environ.get("TEST_DATE", "")
 BUCKET_NAME = os.environ["BUCKET_NAME"]
 PINPOINT_ROLE_ARN = os.environ["PINPOINT_ROLE_ARN"]
 PINPOINT_APP_ID = os.environ["PINPOINT_APP_ID"]
@@ -12,55 +17,41 @@ REDSHIFT_ROLE_ARN = os.environ["REDSHIFT_ROLE_ARN"]
 REDSHIFT_DATABASENAME = os.environ["REDSHIFT_DATABASENAME"]
 REDSHIFT_WORKGROUP = os.environ["REDSHIFT_WORKGROUP"]
 REGION = os.environ.get("REGION", "ap-northeast-1")
+# UNLOAD を並列に実行し、ヘッダ付きの複数ファイルをそのまま Pinpoint にインポートする
+PINPOINT_PARALLEL_UNLOAD = os.environ.get("PINPOINT_PARALLEL_UNLOAD", "false").lower() == "true"
+# full: 全ユーザをインポートしてセグメントを作成する, diff: 前回から新規・変更のあったエンドポイントのみを登録する
+PINPOINT_EXPORT_MODE = os.environ.get("PINPOINT_EXPORT_MODE", "full").lower()
+# インポートジョブの完了を待つ最大時間(分)。超えた場合はエラー終了する
+PINPOINT_IMPORT_TIMEOUT_MINUTES = int(os.environ.get("PINPOINT_IMPORT_TIMEOUT_MINUTES", "60"))
 
+metrics = Metrics("pinpoint")
 rss = boto3.client("redshift-data", region_name=REGION)
+rs_executor = RedshiftStatementExecutor(rss, REDSHIFT_DATABASENAME, REDSHIFT_WORKGROUP, metrics=metrics)
 s3 = boto3.client("s3", region_name=REGION)
 pinpoint = boto3.client("pinpoint", region_name=REGION)
 
 
-def execute_redshift_query(query):
-    response = rss.execute_statement(Database=REDSHIFT_DATABASENAME, WorkgroupName=REDSHIFT_WORKGROUP, Sql=query)
-    query_id = response["Id"]
-
-    while True:
-        status_response = rss.describe_statement(Id=query_id)
-        if status_response["Status"] == "FINISHED":
-            break
-        elif status_response["Status"] == "FAILED":
-            raise Exception(f"Query failed: {status_response['Error']}")
-        time.sleep(5)
+def execute_redshift_query(query, name=None):
+    return rs_executor.execute(query, name)
 
 
 def makesure_empty(s3pathprefix):
-    paginator = s3.get_paginator("list_objects_v2")
-    pages = paginator.paginate(Bucket=BUCKET_NAME, Prefix=s3pathprefix)
+    delete_prefix(s3, BUCKET_NAME, s3pathprefix)
 
-    delete_list = []
-    for page in pages:
-        if "Contents" in page:
-            for obj in page["Contents"]:
-                delete_list.append({"Key": obj["Key"]})
 
-    if delete_list:
-        s3.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": delete_list})
+# (Redshift の式, Pinpoint の CSV ヘッダ)
+USER_LIST_COLUMNS = [
+    ("user_id", "User.UserId"),
+    ("email", "Address"),
+    ("gender", "User.UserAttributes.Gender"),
+    ("CAST(age AS VARCHAR(20))", "User.UserAttributes.Age"),
+    ("COALESCE(interest_name, '''')", "User.UserAttributes.InterestName"),
+    ("''EMAIL''", "ChannelType"),
+]
 
-    print(f"Deleted {len(delete_list)} objects from {BUCKET_NAME}/{s3pathprefix}")
 
-
-def prepare_dataset(s3path):
-    makesure_empty(s3path)
-
-    # 全ユーザデータを興味とともに
-    query = f"""
-        UNLOAD (
-            'SELECT 
-                user_id,
-                email,
-                gender,
-                CAST(age AS VARCHAR(20)),
-                COALESCE(interest_name, ''''),
-                ''EMAIL''
-            FROM (
+# 全ユーザデータを興味とともに
+USER_LIST_SOURCE = """
                 SELECT 
                     um.user_id,
                     um.email,
@@ -76,20 +67,121 @@ def prepare_dataset(s3path):
                     interest_master im ON ui.interest_id = im.interest_id
             ) ranked_interests
             WHERE 
-                interest_rank = 1'
+                interest_rank = 1"""
+
+# 前回エクスポートから属性が変わった、または新規のユーザのみ
+CHANGED_USER_LIST_SOURCE = """
+                SELECT 
+                    s.user_id,
+                    s.email,
+                    s.gender,
+                    s.age,
+                    s.interest_name
+                FROM 
+                    pinpoint_endpoint_stage s
+                LEFT JOIN 
+                    pinpoint_endpoint_snapshot p ON s.user_id = p.user_id
+                WHERE 
+                    p.user_id IS NULL OR p.attr_hash <> s.attr_hash
+            ) changed_endpoints"""
+
+
+def get_user_list_query(s3path, parallel, source=USER_LIST_SOURCE):
+    if parallel:
+        # 各パートファイルに UNLOAD の HEADER でヘッダ行を書き出すため、列名に Pinpoint の属性名を指定する
+        columns = ",\n                ".join(f'{expression} AS "{header}"' for expression, header in USER_LIST_COLUMNS)
+        options = "CSV HEADER"
+    else:
+        columns = ",\n                ".join(expression for expression, _ in USER_LIST_COLUMNS)
+        options = "CSV\n        PARALLEL OFF"
+
+    return f"""
+        UNLOAD (
+            'SELECT 
+                {columns}
+            FROM ({source}'
         )
         TO 's3://{BUCKET_NAME}/{s3path}'
         IAM_ROLE '{REDSHIFT_ROLE_ARN}'
-        CSV
-        PARALLEL OFF;
+        {options};
     """
-    execute_redshift_query(query)
+
+
+def stage_endpoints():
+    # 今回エクスポートする属性とそのハッシュを stage テーブルに保存し、スナップショットとの比較と更新に使う
+    rs_executor.execute_batch(
+        [
+            "DELETE FROM pinpoint_endpoint_stage",
+            f"""
+            INSERT INTO pinpoint_endpoint_stage
+            SELECT 
+                user_id,
+                email,
+                gender,
+                age,
+                interest_name,
+                MD5(
+                    RTRIM(email) || '|' || gender || '|' || CAST(age AS VARCHAR(20)) || '|' || COALESCE(interest_name, '')
+                )
+            FROM ({USER_LIST_SOURCE}
+            """,
+        ],
+        "stage_endpoints",
+    )
+    result = rs_executor.execute(
+        """
+        SELECT COUNT(*)
+        FROM pinpoint_endpoint_stage s
+        LEFT JOIN pinpoint_endpoint_snapshot p ON s.user_id = p.user_id
+        WHERE p.user_id IS NULL OR p.attr_hash <> s.attr_hash
+        """,
+        "count_changed_endpoints",
+    )
+    return int(rs_executor.fetch_records(result["Id"])[0][0])
+
+
+def commit_endpoint_snapshot():
+    # インポートが完了したエンドポイントの属性を次回の比較対象にする
+    rs_executor.execute_batch(
+        [
+            "DELETE FROM pinpoint_endpoint_snapshot",
+            "INSERT INTO pinpoint_endpoint_snapshot SELECT user_id, attr_hash FROM pinpoint_endpoint_stage",
+        ],
+        "commit_endpoint_snapshot",
+    )
+
+
+def unload_user_list(s3path, source):
+    if PINPOINT_PARALLEL_UNLOAD:
+        # ヘッダの大文字小文字を保持するため、同一セッションで case sensitive identifier を有効にする
+        rs_executor.execute_batch(
+            ["SET enable_case_sensitive_identifier TO true", get_user_list_query(s3path, True, source)], "user_list"
+        )
+        keys = get_s3_keys(s3path)
+        print(f"Unloaded {len(keys)} files to {BUCKET_NAME}/{s3path}")
+        # Pinpoint はフォルダを指定すると配下の全ファイルをインポートする
+        return s3path
+
+    execute_redshift_query(get_user_list_query(s3path, False, source), "user_list")
     return add_header_to_s3_file(s3path)
 
 
+def prepare_dataset(s3path):
+    makesure_empty(s3path)
+
+    if PINPOINT_EXPORT_MODE == "diff":
+        changed = stage_endpoints()
+        print(f"Found {changed} new or changed endpoints")
+        if changed == 0:
+            return None
+        return unload_user_list(s3path, CHANGED_USER_LIST_SOURCE)
+
+    return unload_user_list(s3path, USER_LIST_SOURCE)
+
+
 def add_header_to_s3_file(s3_path):
     file_key = get_s3_key(s3_path)
-    header = "User.UserId,Address,User.UserAttributes.Gender,User.UserAttributes.Age,User.UserAttributes.InterestName,ChannelType"
+    header = ",".join(header for _, header in USER_LIST_COLUMNS)
     response = s3.get_object(Bucket=BUCKET_NAME, Key=file_key)
     existing_content = response["Body"].read().decode("utf-8")
     new_content = header + "\n" + existing_content
@@ -97,44 +189,92 @@ def add_header_to_s3_file(s3_path):
     return file_key
 
 
-def get_s3_key(s3_path):
-    response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=s3_path)
-    if "Contents" in response and len(response["Contents"]) > 0:
-        return response["Contents"][0]["Key"]
-    else:
+def get_s3_keys(s3_path):
+    paginator = s3.get_paginator("list_objects_v2")
+    keys = []
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=s3_path):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    if not keys:
         raise ValueError(f"No file found in {s3_path}")
+    return keys
+
+
+def get_prefix_size(s3_path):
+    size = 0
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME, Prefix=s3_path):
+        size += sum(obj["Size"] for obj in page.get("Contents", []))
+    return size
+
+
+def get_s3_key(s3_path):
+    return get_s3_keys(s3_path)[0]
+
+
+def describe_import_job(job_id):
+    import_job = pinpoint.get_import_job(ApplicationId=PINPOINT_APP_ID, JobId=job_id)["ImportJobResponse"]
+    progress = {
+        "CompletedPieces": import_job.get("CompletedPieces"),
+        "TotalPieces": import_job.get("TotalPieces"),
+        "FailedPieces": import_job.get("FailedPieces"),
+        "TotalProcessed": import_job.get("TotalProcessed"),
+        "TotalFailures": import_job.get("TotalFailures"),
+    }
+    if import_job.get("Failures"):
+        progress["Failures"] = import_job["Failures"]
+    return import_job["JobStatus"], progress
 
 
 def import_segment_to_pinpoint(s3_key, target_date):
     segment_name = f"{target_date.strftime('%Y%m%d')}-{str(uuid.uuid4())}"
-    import_job = pinpoint.create_import_job(
-        ApplicationId=PINPOINT_APP_ID,
-        ImportJobRequest={
-            "DefineSegment": True,
-            "Format": "CSV",
-            "RegisterEndpoints": True,
-            "RoleArn": PINPOINT_ROLE_ARN,
-            "S3Url": f"s3://{BUCKET_NAME}/{s3_key}",
-            "SegmentName": segment_name,
-        },
-    )
+    import_job_request = {
+        "DefineSegment": True,
+        "Format": "CSV",
+        "RegisterEndpoints": True,
+        "RoleArn": PINPOINT_ROLE_ARN,
+        "S3Url": f"s3://{BUCKET_NAME}/{s3_key}",
+        "SegmentName": segment_name,
+    }
+    if PINPOINT_EXPORT_MODE == "diff":
+        # 差分のみのセグメントは配信対象として使えないため、エンドポイントの登録だけを行う
+        import_job_request["DefineSegment"] = False
+        del import_job_request["SegmentName"]
+    import_job = pinpoint.create_import_job(ApplicationId=PINPOINT_APP_ID, ImportJobRequest=import_job_request)
     job_id = import_job["ImportJobResponse"]["Id"]
-    while True:
-        job_status = pinpoint.get_import_job(ApplicationId=PINPOINT_APP_ID, JobId=job_id)["ImportJobResponse"]["JobStatus"]
-        if job_status == "COMPLETED":
-            print(f"Segment import completed. Segment name: {segment_name}")
-            break
-        elif job_status in ["FAILED", "CANCELLED"]:
-            print(f"Segment import failed or was cancelled. Status: {job_status}")
-            break
+
+    # FAILED / CANCELLED やタイムアウトの場合は例外で終了し、Step Functions 側でリトライさせる
+    tracker = JobTracker(min_interval=5, max_interval=60, timeout=PINPOINT_IMPORT_TIMEOUT_MINUTES * 60, metrics=metrics)
+    tracker.add("segment import", partial(describe_import_job, job_id), ["COMPLETED"], ["FAILED", "CANCELLED"])
+    job_metrics = tracker.wait_all()[0]
+    if import_job_request["DefineSegment"]:
+        print(f"Segment import completed. Segment name: {segment_name}, metrics: {job_metrics['Progress']}")
+    else:
+        print(f"Endpoint import completed. metrics: {job_metrics['Progress']}")
+    return job_metrics
 
 
 if __name__ == "__main__":
-
-    target_date = datetime.now(JST).date()
+    # Personalize の学習と同じ対象日 (指定がなければ前日) のパーティションで処理する
+    if TEST_DATE:
+        target_date = datetime.strptime(TEST_DATE, "%Y%m%d").replace(tzinfo=JST).date()
+    else:
+        target_date = (datetime.now(JST) - timedelta(days=1)).date()
     date_str = target_date.strftime("%Y/%m/%d")
 
     print(f"Processing data for date: {date_str}")
     s3path = f"{date_str}/user_list/"
-    s3_key = prepare_dataset(s3path)
-    import_segment_to_pinpoint(s3_key, target_date)
+    with metrics.profile(), metrics.span("total", ExportMode=PINPOINT_EXPORT_MODE):
+        with metrics.span("prepare_dataset", ExportMode=PINPOINT_EXPORT_MODE) as span:
+            s3_key = prepare_dataset(s3path)
+            span.add("BytesOut", get_prefix_size(s3path), "Bytes")
+        if s3_key is None:
+            print("No endpoints to import")
+        else:
+            with metrics.span("segment_import", ExportMode=PINPOINT_EXPORT_MODE) as span:
+                progress = import_segment_to_pinpoint(s3_key, target_date)["Progress"]
+                span.add("EndpointsProcessed", progress.get("TotalProcessed") or 0)
+                span.add("EndpointsFailed", progress.get("TotalFailures") or 0)
+            if PINPOINT_EXPORT_MODE == "diff":
+                # インポートに失敗したエンドポイントを次回も差分として送るよう、スナップショットは更新せずに終了する
+                if progress.get("FailedPieces") or progress.get("TotalFailures"):
+                    raise Exception(f"Endpoint import reported failures. Endpoint snapshot was not updated: {progress}")
+                commit_endpoint_snapshot()
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "dataloader"))
+from gaparse import PARSERS, extract_view_items, get_parser  # noqa: E402
+
+event_names = ["page_view", "scroll", "user_engagement", "session_start", "add_to_cart"]
+
+
+def generate_event(view_ratio, num_users, num_items):
+    event_name = "view_item" if random.random() < view_ratio else random.choice(event_names)
+    user_pseudo_id = f"{random.randint(1, num_users)}.{random.randint(1000000000, 9999999999)}"
+    item_id = str(random.randint(1, num_items))
+    # GA4 の BigQuery Export に近い形のネストしたイベント
+    return {
+        "event_date": "20240822",
+        "event_timestamp": random.randint(1724252400000000, 1724338799000000),
+        "event_name": event_name,
+        "event_params": [
+            {"key": key, "value": {"string_value": str(uuid.uuid4()), "int_value": None, "float_value": None, "double_value": None}}
+            for key in ["page_location", "page_title", "page_referrer", "ga_session_id", "engagement_time_msec", "session_engaged"]
+        ],
+        "event_bundle_sequence_id": random.randint(1, 100000),
+        "user_id": str(uuid.uuid4()) if random.random() < 0.5 else None,
+        "user_pseudo_id": user_pseudo_id,
+        "user_first_touch_timestamp": 1724252400000000,
+        "device": {"category": "desktop", "operating_system": "Windows", "browser": "Chrome", "language": "ja-jp"},
+        "geo": {"continent": "Asia", "country": "Japan", "region": "Tokyo", "city": "Minato"},
+        "traffic_source": {"name": "(direct)", "medium": "(none)", "source": "(direct)"},
+        "items": [{"item_id": item_id, "item_name": f"アイテム{item_id}", "price": 1000.0, "quantity": 1}]
+        if event_name in ("view_item", "add_to_cart")
+        else [],
+    }
+
+
+def generate_lines(num_events, view_ratio, num_users, num_items):
+    return [
+        json.dumps(generate_event(view_ratio, num_users, num_items), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        for _ in range(num_events)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GA の JSONL パーサのマイクロベンチマーク")
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--view-ratio", type=float, default=0.1)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    lines = generate_lines(args.events, args.view_ratio, args.users, args.items)
+    total_bytes = sum(len(line) for line in lines)
+    print(f"Generated {len(lines)} events ({total_bytes / 1024 / 1024:.1f} MB)")
+
+    expected = None
+    for name in PARSERS:
+        ga_parser = get_parser(name)
+        elapsed = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            rows = list(extract_view_items(lines, ga_parser))
+            elapsed.append(time.perf_counter() - start)
+        if expected is None:
+            expected = rows
+        elif rows != expected:
+            raise Exception(f"Parser {name} returned different rows from the json parser")
+        best = min(elapsed)
+        print(f"{name:10s} {best:8.3f}s {len(lines) / best:12.0f} events/s {total_bytes / best / 1024 / 1024:8.1f} MB/s rows={len(rows)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+import argparse
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import types
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import partial
+from types import SimpleNamespace
+
+import numpy as np
+
+# データローダーの変換処理を、ローカルのディレクトリを S3、ローカルの PostgreSQL を Aurora に見立ててオフラインで実行し、
+# ステージごとのスループットとピークメモリを計測する
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(TEST_DIR, "..", "common"))
+sys.path.append(os.path.join(TEST_DIR, "..", "dataloader"))
+sys.path.append(TEST_DIR)
+import gen_testdata  # noqa: E402
+
+GA_BUCKET_NAME = "ga"
+TMP_BUCKET_NAME = "tmp"
+
+# test/insert_dummy.sh と同じ列で Aurora の TSV を投入する
+AURORA_COPY_TARGETS = {
+    "interest_master": "interest_master (interest_id, interest_name)",
+    "user_master": "user_master",
+    "item_master": "item_master (item_id, item_name, price, item_category_id)",
+    "user_interest": "user_interest (user_id, interest_id)",
+    "campaign": "campaign (campaign_id, campaign_name)",
+    "purchase_history": "purchase_history",
+}
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class LocalBody:
+    def __init__(self, path):
+        self.f = open(path, "rb")
+
+    def read(self, size=-1):
+        return self.f.read(size)
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.f.read(chunk_size)
+            if not chunk:
+                self.f.close()
+                return
+            yield chunk
+
+
+class LocalPaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix=""):
+        root = os.path.join(self.client.root, Bucket)
+        contents = []
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                key = os.path.relpath(os.path.join(dirpath, filename), root).replace(os.sep, "/")
+                if key.startswith(Prefix) and not key.startswith(".multipart/"):
+                    stat = os.stat(os.path.join(dirpath, filename))
+                    contents.append({"Key": key, "Size": stat.st_size, "ETag": f'"{stat.st_size}-{stat.st_mtime_ns}"'})
+        contents.sort(key=lambda obj: obj["Key"])
+        for start in range(0, len(contents), 1000):
+            yield {"Contents": contents[start : start + 1000]}
+
+
+class LocalS3:
+    # データローダーが利用する S3 の API のみを、root 配下の バケット名/キー のファイルとして実装する
+    exceptions = SimpleNamespace(NoSuchKey=NoSuchKey)
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def get_paginator(self, name):
+        return LocalPaginator(self)
+
+    def get_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise NoSuchKey(Key)
+        return {"Body": LocalBody(path), "ContentLength": os.path.getsize(path)}
+
+    def put_object(self, Bucket, Key, Body):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(Body.encode("utf-8") if isinstance(Body, str) else Body)
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
+        return {}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            path = self._path(Bucket, obj["Key"])
+            if os.path.exists(path):
+                os.remove(path)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f"{time.time_ns()}-{os.getpid()}"
+        os.makedirs(self._path(Bucket, f".multipart/{upload_id}"), exist_ok=True)
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with open(self._path(Bucket, f".multipart/{UploadId}/{PartNumber:05d}"), "wb") as f:
+            f.write(Body)
+        return {"ETag": str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            for part in MultipartUpload["Parts"]:
+                with open(self._path(Bucket, f".multipart/{UploadId}/{part['PartNumber']:05d}"), "rb") as part_file:
+                    shutil.copyfileobj(part_file, f)
+        shutil.rmtree(self._path(Bucket, f".multipart/{UploadId}"))
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        shutil.rmtree(self._path(Bucket, f".multipart/{UploadId}"), ignore_errors=True)
+        return {}
+
+
+def make_db_module(pg_url, s3):
+    # dataloader の db モジュールの代わり。aws_s3.query_export_to_s3 はローカルの PostgreSQL の COPY TO で再現する
+    db = types.ModuleType("db")
+
+    @contextmanager
+    def db_cursor(autocommit=False):
+        import psycopg2
+
+        conn = psycopg2.connect(pg_url)
+        conn.autocommit = autocommit
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def exec_sql(conn, sql, params):
+        export = re.search(r"query_export_to_s3\(\s*'(.*)',\s*aws_commons\.create_s3_uri\(\s*'(.*?)',\s*'(.*?)'", sql, re.DOTALL)
+        with conn.cursor() as cursor:
+            if export is None:
+                cursor.execute(sql)
+                rows = cursor.fetchall() if cursor.description else [(None,)]
+                return SimpleNamespace(scalar=lambda: rows[0][0], fetchone=lambda: rows[0])
+            query, bucket, key = export.group(1).replace("''", "'"), export.group(2), export.group(3)
+            buffer = io.BytesIO()
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+            # aws_s3 と同じく (rows_uploaded, files_uploaded, bytes_uploaded) を返し、0件の場合はファイルを作らない
+            result = (cursor.rowcount, 0, 0)
+            if cursor.rowcount > 0:
+                s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+                result = (cursor.rowcount, 1, len(buffer.getvalue()))
+            return SimpleNamespace(scalar=lambda: result[0], fetchone=lambda: result)
+
+    db.db_cursor = db_cursor
+    db.exec_sql = exec_sql
+    return db
+
+
+def import_dataloader(args):
+    for name, value in {
+        "GA_BUCKET_NAME": GA_BUCKET_NAME,
+        "TMP_BUCKET_NAME": TMP_BUCKET_NAME,
+        "REDSHIFT_ROLE_ARN": "bench",
+        "REDSHIFT_DATABASENAME": "bench",
+        "REDSHIFT_WORKGROUP": "bench",
+        "AWS_DEFAULT_REGION": "ap-northeast-1",
+    }.items():
+        os.environ.setdefault(name, value)
+    s3 = LocalS3(args.work_dir)
+    sys.modules["db"] = make_db_module(args.pg_url, s3)
+    # dumpsql などを相対パスで読むため、コンテナと同じくデータローダーのディレクトリで実行する
+    os.chdir(os.path.join(TEST_DIR, "..", "dataloader"))
+    import dataloader
+
+    dataloader.s3 = s3
+    return dataloader
+
+
+def get_size(root):
+    total = 0
+    for dirpath, _, filenames in os.walk(root):
+        total += sum(os.path.getsize(os.path.join(dirpath, filename)) for filename in filenames)
+    return total
+
+
+def stage_generate(args):
+    gen_args = SimpleNamespace(
+        users=args.users,
+        items=args.items,
+        purchases=args.purchases,
+        events=args.events,
+        view_ratio=args.view_ratio,
+        login_ratio=0.8,
+        ga_files=args.ga_files,
+        chunk_size=200000,
+    )
+    rng = np.random.default_rng(args.seed)
+    user_ids = gen_testdata.make_user_ids(rng, args.users)
+    user_weights = gen_testdata.get_weights(rng, args.users, args.user_skew)
+    item_weights = gen_testdata.get_weights(rng, args.items, args.item_skew)
+    os.makedirs(os.path.join(args.work_dir, "aurora"), exist_ok=True)
+    counts = gen_testdata.generate_aurora(gen_args, rng, user_ids, user_weights, item_weights, os.path.join(args.work_dir, "aurora"))
+    gen_testdata.generate_ga_day(
+        gen_args, rng, user_ids, user_weights, item_weights, args.date, os.path.join(args.work_dir, GA_BUCKET_NAME)
+    )
+    return {"rows": sum(counts.values()) + args.events, "bytes": get_size(args.work_dir)}
+
+
+def stage_ga_transform(args, mode):
+    dataloader = import_dataloader(args)
+    dataloader.GA_STREAMING = mode == "streaming"
+    dataloader.GA_OUTPUT_FORMAT = "parquet" if mode == "parquet" else "csv"
+    dataloader.GA_WORKERS = args.ga_workers
+    dataloader.ga_parser = dataloader.get_parser(args.parser)
+    dataloader.makesure_empty(args.date)
+
+    files = [(key, dataloader.get_view_history_key(key, args.date)) for key in dataloader.get_ga_s3_files(args.date)]
+    if args.ga_workers > 1:
+        manifest = dataloader.RunManifest(dataloader.s3, TMP_BUCKET_NAME, "runs/bench/manifest.json")
+        dataloader.process_ga_files_concurrently(files, manifest, {})
+    else:
+        for file_key, target_key in files:
+            dataloader.process_ga_file(file_key, target_key)
+
+    input_bytes = get_size(os.path.join(args.work_dir, GA_BUCKET_NAME, args.date.strftime("%Y/%m/%d")))
+    return {"rows": args.events, "bytes": input_bytes}
+
+
+def stage_aurora_load(args):
+    import psycopg2
+
+    with open(os.path.join(TEST_DIR, "..", "dbsetup", "aurora", "create_tables.sql")) as f:
+        ddl = re.findall(r"CREATE TABLE IF NOT EXISTS .*?\n\);", f.read(), re.DOTALL)
+    with psycopg2.connect(args.pg_url) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {', '.join(AURORA_COPY_TARGETS)} CASCADE")
+            for statement in ddl:
+                cursor.execute(statement)
+            for table, target in AURORA_COPY_TARGETS.items():
+                with open(os.path.join(args.work_dir, "aurora", f"{table}.tsv")) as f:
+                    cursor.copy_expert(f"COPY {target} FROM STDIN", f)
+            cursor.execute("ANALYZE")
+    rows = sum(sum(1 for _ in open(os.path.join(args.work_dir, "aurora", f"{table}.tsv"))) for table in AURORA_COPY_TARGETS)
+    return {"rows": rows, "bytes": get_size(os.path.join(args.work_dir, "aurora"))}
+
+
+def stage_aurora_dump(args):
+    os.environ["AURORA_EXPORT_CHUNKS"] = args.export_chunks
+    dataloader = import_dataloader(args)
+    tasks = {
+        table_name: (partial(dataloader.dump_table, table_name, args.date, args.date - timedelta(days=365)), [])
+        for table_name in dataloader.AURORA_TABLES
+    }
+    dataloader.run_dag(tasks, max(1, args.aurora_workers))
+    output_bytes = sum(
+        get_size(os.path.join(args.work_dir, TMP_BUCKET_NAME, args.date.strftime("%Y/%m/%d"), table_name))
+        for table_name in dataloader.AURORA_TABLES
+    )
+    return {"rows": None, "bytes": output_bytes}
+
+
+def run_stage(name, func):
+    # ステージごとに fork した子プロセスで実行し、wait4 で子プロセスのみのピーク RSS を取得する
+    read_fd, write_fd = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            result = {"ok": True, **func()}
+        except Exception as e:
+            result = {"ok": False, "error": repr(e)}
+        with os.fdopen(write_fd, "w") as f:
+            json.dump(result, f)
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        output = f.read()
+    _, _, usage = os.wait4(pid, 0)
+    elapsed = time.perf_counter() - start
+    result = json.loads(output) if output else {"ok": False, "error": "stage exited without a result"}
+    result.update({"stage": name, "elapsed": elapsed, "peak_rss_mb": usage.ru_maxrss / 1024})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="データローダーの各ステージのスループットとピークメモリをローカルで計測する")
+    parser.add_argument("--work-dir", default="bench_work")
+    parser.add_argument("--pg-url", default=os.environ.get("BENCH_PG_DSN"), help="Aurora の代わりに使う PostgreSQL (psycopg2 の DSN)")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--purchases", type=int, default=1000000)
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--view-ratio", type=float, default=0.3)
+    parser.add_argument("--user-skew", type=float, default=0.0)
+    parser.add_argument("--item-skew", type=float, default=1.0)
+    parser.add_argument("--ga-files", type=int, default=8)
+    parser.add_argument("--ga-workers", type=int, default=1)
+    parser.add_argument("--aurora-workers", type=int, default=1)
+    parser.add_argument("--export-chunks", default="", help="AURORA_EXPORT_CHUNKS と同じ形式 (例: purchase_history=8,user_master=4)")
+    parser.add_argument("--parser", default="json")
+    parser.add_argument("--modes", default="memory,streaming,parquet", help="GA の変換方式 (memory / streaming / parquet)")
+    parser.add_argument("--date", default="20240822")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.date = datetime.strptime(args.date, "%Y%m%d").date()
+    args.work_dir = os.path.abspath(args.work_dir)
+
+    if os.path.exists(args.work_dir):
+        shutil.rmtree(args.work_dir)
+    os.makedirs(args.work_dir)
+
+    stages = [("generate", partial(stage_generate, args))]
+    stages += [(f"ga:{mode}", partial(stage_ga_transform, args, mode)) for mode in args.modes.split(",") if mode]
+    if args.pg_url:
+        stages += [("aurora:load", partial(stage_aurora_load, args)), ("aurora:dump", partial(stage_aurora_dump, args))]
+    else:
+        print("--pg-url is not set. Skipping the Aurora stages.")
+
+    results = []
+    for name, func in stages:
+        result = run_stage(name, func)
+        results.append(result)
+        if not result["ok"]:
+            print(f"Stage {name} failed: {result['error']}")
+            break
+        print(f"Stage {name} finished in {result['elapsed']:.1f}s")
+
+    print(f"{'stage':16s} {'elapsed':>9s} {'rows/s':>12s} {'MB/s':>8s} {'peak RSS':>10s}")
+    for result in results:
+        if not result["ok"]:
+            print(f"{result['stage']:16s} failed")
+            continue
+        rows = f"{result['rows'] / result['elapsed']:12.0f}" if result.get("rows") else f"{'-':>12s}"
+        print(
+            f"{result['stage']:16s} {result['elapsed']:8.2f}s {rows} {result['bytes'] / result['elapsed'] / 1024 / 1024:8.1f} "
+            f"{result['peak_rss_mb']:8.0f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import io
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import psycopg2
+
+# Personalize の UNLOAD と同じクエリで比較するため、personalize.py からクエリを生成する
+for name in [
+    "BUCKET_NAME",
+    "PERSONALIZE_ROLE_ARN",
+    "REDSHIFT_ROLE_ARN",
+    "REDSHIFT_DATABASENAME",
+    "REDSHIFT_WORKGROUP",
+    "PERSONALIZE_DSG",
+    "PERSONALIZE_ITEM_DATASET",
+    "PERSONALIZE_USER_DATASET",
+    "PERSONALIZE_INTERACTION_DATASET",
+    "PERSONALIZE_RECOMMENDER_NAME",
+]:
+    os.environ.setdefault(name, "bench")
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "common"))
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "personalize"))
+from personalize import get_dataset_selects  # noqa: E402
+
+JST = timezone(timedelta(hours=+9))
+
+# Redshift の設計をローカルの PostgreSQL で近似する。Redshift にはインデックスがないため、ソートキー以外のインデックスは作らない
+# before: 変更前の create_tables.sql (CHAR のユーザ ID、ソートキーなし)
+# after: V004__table_design.sql (VARCHAR のユーザ ID。ソートキーはソートキーの順に格納して BRIN インデックス (ゾーンマップ相当) を作成する)
+DESIGNS = {
+    "before": {
+        "user_id_type": "CHAR(64)",
+        "email_type": "CHAR(256)",
+        "sort_keys": {},
+    },
+    "after": {
+        "user_id_type": "VARCHAR(64)",
+        "email_type": "VARCHAR(256)",
+        # テーブル名: (ソートキーの列, 行の中での列の位置)
+        "sort_keys": {
+            "user_master": ("user_id", 0),
+            "user_interest": ("user_id", 0),
+            "purchase_history": ("purchase_datetime", 3),
+            "view_history": ("view_datetime", 2),
+        },
+    },
+}
+
+
+def create_tables(cursor, schema, design):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {schema}")
+    cursor.execute(f"SET search_path TO {schema}")
+    cursor.execute(
+        f"""CREATE TABLE user_master (
+            user_id {design['user_id_type']} NOT NULL,
+            email {design['email_type']} NOT NULL,
+            gender VARCHAR(64) NOT NULL,
+            age INTEGER NOT NULL,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )"""
+    )
+    cursor.execute(f"CREATE TABLE user_interest (user_id {design['user_id_type']}, interest_id BIGINT)")
+    cursor.execute(
+        "CREATE TABLE item_master (item_id BIGINT, item_name VARCHAR(1024) NOT NULL, price FLOAT NOT NULL, item_category_id BIGINT)"
+    )
+    cursor.execute(
+        f"""CREATE TABLE purchase_history (
+            user_id {design['user_id_type']}, item_id BIGINT, campaign_id BIGINT, purchase_datetime TIMESTAMPTZ
+        )"""
+    )
+    cursor.execute(f"CREATE TABLE view_history (user_id {design['user_id_type']}, item_id BIGINT, view_datetime TIMESTAMPTZ)")
+
+
+def generate_data(args, target_date):
+    random.seed(args.seed)
+    now = datetime.now()
+    user_ids = [str(uuid.UUID(int=random.getrandbits(128))) for _ in range(args.users)]
+    users = [(user_id, f"{user_id}@www.example.com", random.choice(["男性", "女性"]), random.randint(18, 80), now, now) for user_id in user_ids]
+    interests = [(user_id, interest_id) for user_id in user_ids for interest_id in random.sample(range(1, 11), random.randint(1, 5))]
+    items = [(i, f"アイテム{i}", random.randint(100, 1000), random.randint(1, 10)) for i in range(1, args.items + 1)]
+
+    # 期間の最終日が target_date になるよう、args.days 日分の閲覧・購買を生成する
+    start = datetime.combine(target_date - timedelta(days=args.days - 1), datetime.min.time(), JST)
+    seconds = args.days * 86400
+    views = [
+        (random.choice(user_ids), random.randint(1, args.items), start + timedelta(seconds=random.randrange(seconds)))
+        for _ in range(args.views)
+    ]
+    purchases = [
+        (random.choice(user_ids), random.randint(1, args.items), None, start + timedelta(seconds=random.randrange(seconds)))
+        for _ in range(args.views // 20)
+    ]
+    return {"user_master": users, "user_interest": interests, "item_master": items, "purchase_history": purchases, "view_history": views}
+
+
+def copy_rows(cursor, table, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join("\\N" if value is None else str(value) for value in row) + "\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} FROM STDIN", buffer)
+
+
+def load_data(cursor, design, data):
+    for table, rows in data.items():
+        if table in design["sort_keys"]:
+            _, position = design["sort_keys"][table]
+            rows = sorted(rows, key=lambda row: row[position])
+        copy_rows(cursor, table, rows)
+    for table, (column, _) in design["sort_keys"].items():
+        cursor.execute(f"CREATE INDEX ON {table} USING BRIN ({column})")
+    cursor.execute("ANALYZE")
+
+
+def get_queries(target_date):
+    queries = []
+    for import_mode in ["FULL", "INCREMENTAL"]:
+        for name, select in get_dataset_selects(target_date, import_mode):
+            # UNLOAD 用にエスケープされた引用符を戻し、結果の転送を除いたクエリの実行時間を測る
+            queries.append((f"{import_mode.lower()}:{name}", f"SELECT COUNT(*) FROM ({select.replace(chr(39) * 2, chr(39))}) q"))
+    return queries
+
+
+def run_query(cursor, sql, repeat):
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql)
+        rows = cursor.fetchone()[0]
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed), rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redshift のテーブル設計変更前後の Personalize クエリのベンチマーク (PostgreSQL で近似)")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_PG_DSN", "dbname=postgres"))
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--views", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--target-date", default=None, help="YYYYMMDD (省略時は前日)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.target_date:
+        target_date = datetime.strptime(args.target_date, "%Y%m%d").date()
+    else:
+        target_date = date.today() - timedelta(days=1)
+
+    data = generate_data(args, target_date)
+    print(f"Generated {args.users} users, {args.items} items, {args.views} views over {args.days} days")
+    queries = get_queries(target_date)
+
+    results = {}
+    with psycopg2.connect(args.dsn) as conn:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for design_name, design in DESIGNS.items():
+                schema = f"bench_{design_name}"
+                start = time.perf_counter()
+                create_tables(cursor, schema, design)
+                load_data(cursor, design, data)
+                print(f"Loaded {schema} in {time.perf_counter() - start:.1f}s")
+                for query_name, sql in queries:
+                    results[(design_name, query_name)] = run_query(cursor, sql, args.repeat)
+                cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+
+    print(f"{'query':28s} {'before':>10s} {'after':>10s} {'speedup':>8s} rows")
+    for query_name, _ in queries:
+        before, before_rows = results[("before", query_name)]
+        after, after_rows = results[("after", query_name)]
+        if before_rows != after_rows:
+            raise Exception(f"Query {query_name} returned {before_rows} rows before and {after_rows} rows after")
+        print(f"{query_name:28s} {before:9.3f}s {after:9.3f}s {before / after:7.2f}x {after_rows}")
+
+
+if __name__ == "__main__":
+    main()
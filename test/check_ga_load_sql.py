@@ -0,0 +1,112 @@
+import argparse
+import os
+import re
+import sys
+import tempfile
+from datetime import date
+from types import SimpleNamespace
+
+import psycopg2
+
+# view_history の取り込み SQL (galoadsql/) をローカルの PostgreSQL で2回ずつ実行し、再実行しても結果が変わらないことを確認する
+# COPY の代わりに、対象日の範囲外の行を含むファイルの内容を一時テーブルに INSERT する
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(TEST_DIR)
+import bench_pipeline  # noqa: E402
+
+TARGET_DATES = [date(2024, 8, 22)]
+EXISTING_ROWS = [
+    # 対象日の前のデータ (どちらの方法でも残る)
+    ("user-a", 1, "2024-08-20 12:00:00+09:00"),
+    # 対象日の古いデータ (replace の場合は削除される)
+    ("user-b", 2, "2024-08-22 08:00:00+09:00"),
+]
+FILE_ROWS = [
+    ("user-c", 3, "2024-08-22 10:00:00+09:00"),
+    ("user-c", 3, "2024-08-22 10:00:00+09:00"),
+    ("user-d", 4, "2024-08-22 23:59:59+09:00"),
+    # 対象日の範囲外 (日付をまたいで記録されたイベント)
+    ("user-e", 5, "2024-08-21 23:59:58+09:00"),
+    ("user-f", 6, "2024-08-23 00:00:05+09:00"),
+]
+EXPECTED = {
+    "dedup": set(EXISTING_ROWS) | set(FILE_ROWS),
+    "replace": {EXISTING_ROWS[0]} | set(FILE_ROWS),
+}
+# view_daily_summary の集計済みの日 (Redshift の TRUNC と同じく UTC の日付)。取り込んだ行の日 (21, 22日) は未集計に戻る
+SUMMARY_DATES = [date(2024, 8, 20), date(2024, 8, 21), date(2024, 8, 22), date(2024, 8, 23)]
+EXPECTED_SUMMARY_DATES = {date(2024, 8, 20), date(2024, 8, 23)}
+
+
+def get_rows(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT user_id, item_id, to_char(view_datetime AT TIME ZONE 'Asia/Tokyo', 'YYYY-MM-DD HH24:MI:SS') || '+09:00'"
+            " FROM view_history"
+        )
+        return cursor.fetchall()
+
+
+def run_load_sql(pg_url, schema, sql):
+    # Redshift Data API と同じく、実行ごとに新しいセッションで一時テーブルを作る
+    values = ", ".join(f"('{user_id}', {item_id}, '{view_datetime}')" for user_id, item_id, view_datetime in FILE_ROWS)
+    sql = re.sub(r"COPY view_history_temp.*?;", f"INSERT INTO view_history_temp VALUES {values};", sql, flags=re.DOTALL)
+    conn = psycopg2.connect(pg_url)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SET search_path TO {schema}")
+            cursor.execute(sql)
+    finally:
+        conn.close()
+
+
+def check(dataloader, pg_url, load_strategy):
+    schema = f"check_ga_load_{load_strategy}"
+    conn = psycopg2.connect(pg_url)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cursor.execute(f"CREATE SCHEMA {schema}")
+            cursor.execute(f"SET search_path TO {schema}")
+            cursor.execute("CREATE TABLE view_history (user_id VARCHAR(64), item_id BIGINT, view_datetime TIMESTAMPTZ)")
+            cursor.executemany("INSERT INTO view_history VALUES (%s, %s, %s)", EXISTING_ROWS)
+            cursor.execute("CREATE TABLE view_daily_summary_dates (view_date DATE)")
+            cursor.executemany("INSERT INTO view_daily_summary_dates VALUES (%s)", [(d,) for d in SUMMARY_DATES])
+            # Redshift の TRUNC(timestamptz) は UTC の日付を返す
+            cursor.execute("CREATE FUNCTION trunc(TIMESTAMPTZ) RETURNS DATE AS $$ SELECT ($1 AT TIME ZONE 'UTC')::DATE $$ LANGUAGE SQL")
+
+        sql = dataloader.get_load_sql(TARGET_DATES, "s3://check/view_history/", "CSV", load_strategy, invalidate_summary=True)
+        for attempt in (1, 2):
+            run_load_sql(pg_url, schema, sql)
+            rows = get_rows(conn)
+            if len(rows) != len(set(rows)) or set(rows) != EXPECTED[load_strategy]:
+                expected = sorted(EXPECTED[load_strategy])
+                raise AssertionError(f"{load_strategy} (run {attempt}): expected {expected}, got {sorted(rows)}")
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT view_date FROM view_daily_summary_dates")
+                summary_dates = {record[0] for record in cursor.fetchall()}
+            if summary_dates != EXPECTED_SUMMARY_DATES:
+                raise AssertionError(f"{load_strategy} (run {attempt}): view_daily_summary_dates is {sorted(summary_dates)}")
+            print(f"{load_strategy} (run {attempt}): OK ({len(rows)} rows)")
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="view_history の取り込み SQL の再実行時の結果をローカルの PostgreSQL で確認する")
+    parser.add_argument("--pg-url", required=True, help="psycopg2 の DSN")
+    parser.add_argument("--strategies", default="dedup,replace")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        dataloader = bench_pipeline.import_dataloader(SimpleNamespace(work_dir=work_dir, pg_url=args.pg_url))
+        for load_strategy in args.strategies.split(","):
+            check(dataloader, args.pg_url, load_strategy)
+
+
+if __name__ == "__main__":
+    main()
@@ -48,10 +48,11 @@ def generate_dummy_data():
 
     # 購買履歴（campaign_idを追加）
     purchase_history = []
+    user_ids = [u.split("\t")[0] for u in user_master]
     end_date = datetime.now()
     start_date = end_date - timedelta(days=365)
     for _ in range(1000):
-        user_id = random.choice([u.split("\t")[0] for u in user_master])
+        user_id = random.choice(user_ids)
         item_id = random.randint(1, num_items)
         purchase_date = start_date + timedelta(seconds=random.randint(0, int((end_date - start_date).total_seconds())))
 
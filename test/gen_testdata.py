@@ -0,0 +1,193 @@
+import argparse
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+JST = timezone(timedelta(hours=+9))
+
+interests = ["スポーツ", "音楽", "映画", "読書", "旅行", "料理", "ファッション", "テクノロジー", "アウトドア", "ゲーム"]
+campaigns = ["キャンペーン1", "キャンペーン2"]
+genders = np.array(["男性", "女性"])
+other_events = np.array(["page_view", "scroll", "user_engagement", "session_start", "add_to_cart"])
+
+
+def get_weights(rng, n, skew):
+    # skew=0 は一様分布、大きいほど一部のユーザ・アイテムに集中する (Zipf 分布)。人気の順位は ID と無関係にする
+    if skew <= 0:
+        return None
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return rng.permutation(weights / weights.sum())
+
+
+def sample(rng, n, size, weights):
+    if weights is None:
+        return rng.integers(0, n, size)
+    return rng.choice(n, size, p=weights)
+
+
+def make_user_ids(rng, n):
+    raw = rng.bytes(16 * n)
+    return np.array([str(uuid.UUID(bytes=raw[i : i + 16])) for i in range(0, 16 * n, 16)])
+
+
+def write_tsv(f, *columns):
+    # 列ごとに numpy で文字列に変換し、行の組み立てだけを Python で行う
+    columns = [column.astype(str).tolist() if isinstance(column, np.ndarray) else column for column in columns]
+    f.write("\n".join(map("\t".join, zip(*columns))))
+    f.write("\n")
+
+
+def chunks(total, chunk_size):
+    for start in range(0, total, chunk_size):
+        yield min(chunk_size, total - start)
+
+
+def generate_aurora(args, rng, user_ids, user_weights, item_weights, out_dir):
+    now = np.datetime64(datetime.now().replace(microsecond=0), "s")
+    counts = {}
+
+    with open(os.path.join(out_dir, "interest_master.tsv"), "w") as f:
+        write_tsv(f, np.arange(1, len(interests) + 1), np.array(interests))
+    counts["interest_master"] = len(interests)
+
+    with open(os.path.join(out_dir, "campaign.tsv"), "w") as f:
+        write_tsv(f, np.arange(1, len(campaigns) + 1), np.array(campaigns))
+    counts["campaign"] = len(campaigns)
+
+    with open(os.path.join(out_dir, "user_master.tsv"), "w") as f:
+        for offset in range(0, args.users, args.chunk_size):
+            ids = user_ids[offset : offset + args.chunk_size]
+            size = len(ids)
+            write_tsv(
+                f,
+                ids,
+                np.char.add(ids, "@www.example.com"),
+                genders[rng.integers(0, 2, size)],
+                rng.integers(18, 81, size),
+                np.full(size, now),
+                np.full(size, now),
+            )
+    counts["user_master"] = args.users
+
+    with open(os.path.join(out_dir, "item_master.tsv"), "w") as f:
+        for offset in range(0, args.items, args.chunk_size):
+            item_ids = np.arange(offset + 1, min(offset + args.chunk_size, args.items) + 1)
+            size = len(item_ids)
+            write_tsv(
+                f, item_ids, np.char.add("アイテム", item_ids.astype(str)), rng.integers(100, 1001, size), rng.integers(1, 11, size)
+            )
+    counts["item_master"] = args.items
+
+    # ユーザごとに 1〜5 個の重複しない興味を持たせる
+    counts["user_interest"] = 0
+    with open(os.path.join(out_dir, "user_interest.tsv"), "w") as f:
+        for offset in range(0, args.users, args.chunk_size):
+            ids = user_ids[offset : offset + args.chunk_size]
+            ranked = rng.random((len(ids), len(interests))).argsort(axis=1) + 1
+            mask = np.arange(len(interests)) < rng.integers(1, 6, len(ids))[:, None]
+            rows = np.nonzero(mask)
+            write_tsv(f, ids[rows[0]], ranked[rows])
+            counts["user_interest"] += len(rows[0])
+
+    # 購買履歴は過去1年分。20% の確率の更に半分でキャンペーン ID を付与する
+    start = now - np.timedelta64(365, "D")
+    with open(os.path.join(out_dir, "purchase_history.tsv"), "w") as f:
+        for size in chunks(args.purchases, args.chunk_size):
+            campaign_ids = rng.integers(1, len(campaigns) + 1, size).astype(str)
+            campaign_ids[rng.random(size) >= 0.1] = "\\N"
+            write_tsv(
+                f,
+                user_ids[sample(rng, args.users, size, user_weights)],
+                sample(rng, args.items, size, item_weights) + 1,
+                campaign_ids,
+                start + rng.integers(0, 365 * 86400, size).astype("timedelta64[s]"),
+            )
+    counts["purchase_history"] = args.purchases
+    return counts
+
+
+def generate_ga_day(args, rng, user_ids, user_weights, item_weights, target_date, out_dir):
+    # GA4 の BigQuery Export を Glue で JSON に書き出した形式 (1行1イベント) を、日ごとに args.ga_files 個のファイルに分けて出力する
+    day_dir = os.path.join(out_dir, target_date.strftime("%Y/%m/%d"))
+    os.makedirs(day_dir, exist_ok=True)
+    day_start = int(datetime.combine(target_date, datetime.min.time(), JST).timestamp() * 1000000)
+    event_date = target_date.strftime("%Y%m%d")
+    files = [open(os.path.join(day_dir, f"part-{i:05d}.json"), "w") for i in range(args.ga_files)]
+    try:
+        for size in chunks(args.events, args.chunk_size):
+            is_view = rng.random(size) < args.view_ratio
+            event_names = np.where(is_view, "view_item", other_events[rng.integers(0, len(other_events), size)])
+            timestamps = day_start + rng.integers(0, 86400 * 1000000, size)
+            users = sample(rng, args.users, size, user_weights)
+            logged_in = rng.random(size) < args.login_ratio
+            item_ids = sample(rng, args.items, size, item_weights) + 1
+            session_ids = rng.integers(1000000000, 9999999999, size)
+            lines = []
+            for event_name, timestamp, user, login, item_id, session_id in zip(
+                event_names.tolist(), timestamps.tolist(), users.tolist(), logged_in.tolist(), item_ids.tolist(), session_ids.tolist()
+            ):
+                user_id = f'"{user_ids[user]}"' if login else "null"
+                items = f'[{{"item_id":"{item_id}","item_name":"アイテム{item_id}","price":1000.0,"quantity":1}}]' if event_name == "view_item" else "[]"
+                lines.append(
+                    f'{{"event_date":"{event_date}","event_timestamp":{timestamp},"event_name":"{event_name}",'
+                    f'"event_params":[{{"key":"ga_session_id","value":{{"int_value":{session_id}}}}},'
+                    f'{{"key":"page_location","value":{{"string_value":"https://www.example.com/product.html?id={item_id}"}}}}],'
+                    f'"user_id":{user_id},"user_pseudo_id":"{user}.{session_id}",'
+                    f'"device":{{"category":"desktop","operating_system":"Windows","browser":"Chrome","language":"ja-jp"}},'
+                    f'"geo":{{"continent":"Asia","country":"Japan","region":"Tokyo","city":"Minato"}},"items":{items}}}'
+                )
+            # GA のエクスポートはファイル内で時刻順に並んでいないため、チャンクの行を各ファイルに振り分ける
+            for i, f in enumerate(files):
+                if lines[i :: len(files)]:
+                    f.write("\n".join(lines[i :: len(files)]) + "\n")
+    finally:
+        for f in files:
+            f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aurora の TSV と GA4 の JSONL のダミーデータを生成する")
+    parser.add_argument("--out", default="testdata")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--purchases", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=100000, help="1日あたりの GA イベント数")
+    parser.add_argument("--view-ratio", type=float, default=0.3, help="GA イベントのうち view_item の割合")
+    parser.add_argument("--login-ratio", type=float, default=0.8, help="GA イベントのうち user_id を持つ割合")
+    parser.add_argument("--user-skew", type=float, default=0.0, help="ユーザの偏り (Zipf の指数、0 で一様)")
+    parser.add_argument("--item-skew", type=float, default=1.0, help="アイテムの偏り (Zipf の指数、0 で一様)")
+    parser.add_argument("--date", default=None, help="GA の最終日 YYYYMMDD (省略時は前日)")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--ga-files", type=int, default=4, help="1日あたりの GA のファイル数")
+    parser.add_argument("--chunk-size", type=int, default=200000, help="一度にメモリ上で生成する行数")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--skip-aurora", action="store_true")
+    parser.add_argument("--skip-ga", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    end_date = datetime.strptime(args.date, "%Y%m%d").date() if args.date else (datetime.now(JST) - timedelta(days=1)).date()
+    user_ids = make_user_ids(rng, args.users)
+    user_weights = get_weights(rng, args.users, args.user_skew)
+    item_weights = get_weights(rng, args.items, args.item_skew)
+
+    if not args.skip_aurora:
+        start = time.perf_counter()
+        aurora_dir = os.path.join(args.out, "aurora")
+        os.makedirs(aurora_dir, exist_ok=True)
+        counts = generate_aurora(args, rng, user_ids, user_weights, item_weights, aurora_dir)
+        print(f"Aurora: {', '.join(f'{table}={count}' for table, count in counts.items())} in {time.perf_counter() - start:.1f}s")
+
+    if not args.skip_ga:
+        for i in range(args.days):
+            start = time.perf_counter()
+            target_date = end_date - timedelta(days=args.days - 1 - i)
+            generate_ga_day(args, rng, user_ids, user_weights, item_weights, target_date, os.path.join(args.out, "ga"))
+            print(f"GA: {args.events} events for {target_date} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,11 +15,11 @@ insert_data() {
 }
 
 # 各テーブルにデータを投入
-insert_data "interest_master" "interest_master.tsv"
+insert_data "interest_master (interest_id, interest_name)" "interest_master.tsv"
 insert_data "user_master" "user_master.tsv"
-insert_data "item_master" "item_master.tsv"
-insert_data "user_interest" "user_interest.tsv"
-insert_data "campaign" "campaign.tsv"
+insert_data "item_master (item_id, item_name, price, item_category_id)" "item_master.tsv"
+insert_data "user_interest (user_id, interest_id)" "user_interest.tsv"
+insert_data "campaign (campaign_id, campaign_name)" "campaign.tsv"
 insert_data "purchase_history" "purchase_history.tsv"
 
 echo "Data insertion complete."
\ No newline at end of file